@@ -46,75 +46,385 @@
                 <option label="Debug" value="Debug"/>
             </options>
         </param>
+        <param field="Mode6" label="Options" width="300px" default="" />
     </params>
 </plugin>
 """
 
+import time
+
+# Domoticz waits for the plugin to load; the time it takes is logged on start, to keep an eye on it.
+
+LOADING = time.perf_counter()
+
 import Domoticz
-import solaredge_modbus
 import json
-
+import math
+import os
+import random
+import struct
+import threading
+
+from bisect import bisect_left
+from collections import deque
+from functools import lru_cache
+from itertools import islice
 from datetime import datetime, timedelta
 from enum import IntEnum, unique, auto
-from pymodbus.exceptions import ConnectionException
+
+#
+# solaredge_modbus and pymodbus take most of the time to load, while only the readers need them.
+# Each reader loads them when its thread starts, and so do the tables that use their status maps.
+# Modules are only imported once, so loading them again costs next to nothing.
+#
+
+solaredge_modbus = None
+
+def load_modbus():
+    global solaredge_modbus, Endian, ConnectionException, BinaryPayloadDecoder, ReadHoldingRegistersResponse
+
+    from pymodbus.constants import Endian
+    from pymodbus.exceptions import ConnectionException
+    from pymodbus.payload import BinaryPayloadDecoder
+    from pymodbus.register_read_message import ReadHoldingRegistersResponse
+    import solaredge_modbus
+
+#
+# Logging happens on every heartbeat, for every unit.
+# The Logger only formats a message when its level is active, so logging costs next to nothing when it is not.
+# With the Extra level, the values read from the inverter are dumped at most once per dump interval.
+#
+
+class Logger:
+
+    NORMAL = 0
+    EXTRA = 1
+    DEBUG = 2
+
+    LEVELS = {
+        "Normal": NORMAL,
+        "Extra": EXTRA,
+        "Debug": DEBUG
+    }
+
+    def __init__(self):
+        self.level = Logger.NORMAL
+        self.debugging = False
+        self.dump_interval = 60
+        self.last_dump = None
+
+    def set_level(self, level):
+        self.level = Logger.LEVELS.get(level, Logger.NORMAL)
+        self.debugging = self.level >= Logger.DEBUG
+        Domoticz.Debugging(1 if self.debugging else 0)
+
+    def debug(self, message, *args):
+        if self.debugging:
+            Domoticz.Debug(message.format(*args) if args else message)
+
+    def dump(self, values):
+        if self.level >= Logger.EXTRA:
+            now = time.monotonic()
+            if self.last_dump is None or now - self.last_dump >= self.dump_interval:
+                self.last_dump = now
+                to_log = {source: {k: v for (k, v) in values[source].items() if k != "c_serialnumber"} for source in values}
+                Domoticz.Log("inverter values: {}".format(json.dumps(to_log, indent=4, sort_keys=False)))
 
 #
 # Domoticz shows graphs with intervals of 5 minutes.
 # When collecting information from the inverter more frequently than that, then it makes no sense to only show the last value.
 #
-# The Average class can be used to calculate the average value based on a sliding window of samples.
-# The number of samples stored depends on the interval used to collect the value from the inverter itself.
+# The Window class keeps the (timestamp, value) samples of the last 5 minutes and provides statistics over them:
+# - the average is weighted by time; each value counts for the time since the previous sample was taken,
+#   so the latest value counts as soon as it arrives.
+#   The area under the samples is kept up to date while samples are added and removed.
+# - monotonic queues hold the candidates for the maximum and minimum.
+# Heartbeats may be delayed and reads may fail; using the timestamps makes sure the window still covers 5 minutes.
 #
 
-class Average:
+class Window:
 
     def __init__(self):
-        self.samples = []
-        self.max_samples = 30
+        self.period = 300
+        self.clear()
+
+    def clear(self):
+        self.samples = deque()
+        self.maxima = deque()
+        self.minima = deque()
+        self.area = 0
+        self.count = 0
+
+    def set_period(self, period):
+        self.period = max(1, period)
+
+    def copy(self):
+        return type(self)()
+
+    def add(self, value, timestamp):
+        samples = self.samples
+
+        # Samples should arrive in order; start over when the clock jumped back.
+
+        if samples and timestamp < samples[-1][0]:
+            self.clear()
+            samples = self.samples
+
+        if samples:
+            self.area += value * (timestamp - samples[-1][0])
+        samples.append((timestamp, value))
+
+        # Forget about the samples that dropped out of the window.
+        # The first sample left starts the window; the time before it no longer counts.
+
+        oldest = timestamp - self.period
+        while samples[0][0] < oldest:
+            (t, v) = samples.popleft()
+            (t_next, v_next) = samples[0]
+            self.area -= v_next * (t_next - t)
+
+        # Adding and subtracting floats slowly drifts away from the real area.
+        # Recalculate it once in a while; that still is constant time per sample.
+
+        self.count += 1
+        if self.count >= len(samples):
+            self.count = 0
+            self.area = sum(v_next * (t_next - t) for ((t, _), (t_next, v_next)) in zip(samples, islice(samples, 1, None)))
+
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((timestamp, value))
+        while self.maxima[0][0] < oldest:
+            self.maxima.popleft()
+
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((timestamp, value))
+        while self.minima[0][0] < oldest:
+            self.minima.popleft()
+
+    def duration(self):
+        return self.samples[-1][0] - self.samples[0][0]
+
+    def average(self):
+        duration = self.duration()
+        if duration > 0:
+            return self.area / duration
+        else:
+            return self.samples[-1][1]
+
+    def maximum(self):
+        return self.maxima[0][1]
+
+    def minimum(self):
+        return self.minima[0][1]
+
+    def last(self):
+        return self.samples[-1][1]
+
+    # The samples as [timestamp, value] pairs, to store them and to restore them after a restart.
+
+    def get_samples(self):
+        return [list(sample) for sample in self.samples]
 
-    def set_max_samples(self, max):
-        self.max_samples = max
-        if self.max_samples < 1:
-            self.max_samples = 1
+    def set_samples(self, samples):
+        self.clear()
+        for (timestamp, value) in samples:
+            self.add(value, timestamp)
 
-    def update(self, new_value, scale = 0):
-        self.samples.append(new_value * (10 ** scale))
-        while (len(self.samples) > self.max_samples):
-            del self.samples[0]
+#
+# The Average class calculates the average value based on a sliding window of samples.
+#
 
-        Domoticz.Debug("Average: {} - {} values".format(self.get(), len(self.samples)))
+class Average(Window):
 
     def get(self):
-        return sum(self.samples) / len(self.samples)
+        return self.average()
 
 #
-# Domoticz shows graphs with intervals of 5 minutes.
-# When collecting information from the inverter more frequently than that, then it makes no sense to only show the last value.
+# The Maximum class calculates the highest value based on a sliding window of samples.
+#
+
+class Maximum(Window):
+
+    def get(self):
+        return self.maximum()
+
+#
+# The Minimum class calculates the lowest value based on a sliding window of samples.
+#
+
+class Minimum(Window):
+
+    def get(self):
+        return self.minimum()
+
+#
+# The Energy class calculates the energy produced from the power samples, using the trapezoid rule.
+#
+# The energy_total register changes in coarse steps and is missing whenever a read fails.
+# The integrated energy fills in the time between the steps; each time the register changes, the total continues from it.
+# The total never goes back, unless the register itself does.
+# Gaps of up to ENERGY_MAX_GAP seconds are bridged with a straight line; after longer gaps only the register counts.
+# The same samples give the energy produced today and in the previous interval of the period, without extra reads.
+#
+
+ENERGY_MAX_GAP = 120
+
+class Energy:
+
+    def __init__(self, power, power_scale = None):
+        self.power = power
+        self.power_scale = power_scale
+        self.period = 300
+        self.clear()
+
+        # The EnergyToday and EnergyInterval views of the same source share this integrator.
+
+        self.energy = self
+
+    def clear(self):
+        self.timestamp = None
+        self.last_power = None
+        self.counter = None
+        self.integrated = 0
+        self.total = None
+        self.day = None
+        self.day_total = None
+        self.interval_start = None
+        self.interval_total = None
+        self.interval = 0
+
+    def set_period(self, period):
+        self.period = max(1, period)
+
+    def copy(self):
+        return type(self)(self.power, self.power_scale)
+
+    def add(self, power, counter, timestamp):
+
+        # Each row of the source adds the same sample; only the first one counts.
+
+        if timestamp == self.timestamp:
+            return
+
+        previous = self.total
+
+        # The power in W over a number of seconds gives the energy in Wh.
+        # Power drawn by the inverter at night is not produced energy.
+
+        if self.timestamp is not None and 0 < timestamp - self.timestamp <= ENERGY_MAX_GAP:
+            self.integrated += (max(0, self.last_power) + max(0, power)) * (timestamp - self.timestamp) / 7200
+
+        self.timestamp = timestamp
+        self.last_power = power
+
+        if counter != self.counter:
+            if self.counter is not None and counter < self.counter:
+                previous = self.total = None
+            self.counter = counter
+            self.integrated = 0
+
+        total = counter + self.integrated
+        if self.total is None or total > self.total:
+            self.total = total
+
+        # Today starts at the total of the last sample of yesterday.
+
+        day = datetime.fromtimestamp(timestamp).toordinal()
+        if day != self.day or self.total < self.day_total:
+            self.day = day
+            self.day_total = previous if previous is not None else self.total
+
+        # The intervals are aligned to multiples of the period, like the 5 minute values in Domoticz.
+
+        start = timestamp - timestamp % self.period
+        if start != self.interval_start or self.total < self.interval_total:
+            self.interval = self.total - self.interval_total if self.interval_total is not None and self.total >= self.interval_total else 0
+            self.interval_start = start
+            self.interval_total = self.total
+
+    def get(self):
+        return int(self.total)
+
+    # The state as a list, to store it and to restore it after a restart.
+
+    def get_samples(self):
+        if self.total is None:
+            return []
+        return [self.timestamp, self.last_power, self.counter, self.integrated, self.total,
+                self.day, self.day_total, self.interval_start, self.interval_total, self.interval]
+
+    def set_samples(self, samples):
+        self.clear()
+        if samples:
+            (self.timestamp, self.last_power, self.counter, self.integrated, self.total,
+             self.day, self.day_total, self.interval_start, self.interval_total, self.interval) = samples
+
 #
-# The Maximum class can be used to calculate the highest value based on a sliding window of samples.
-# The number of samples stored depends on the interval used to collect the value from the inverter itself.
+# An EnergyView shows a part of the Energy of the same source, so the power is integrated only once.
+# setupDevices links each view to the Energy; the state is kept by the Energy itself.
 #
 
-class Maximum:
+class EnergyView:
 
     def __init__(self):
-        self.samples = []
-        self.max_samples = 30
+        self.energy = None
+
+    def set_period(self, period):
+        pass
+
+    def copy(self):
+        return type(self)()
+
+    def get_samples(self):
+        return []
 
-    def set_max_samples(self, max):
-        self.max_samples = max
-        if self.max_samples < 1:
-            self.max_samples = 1
+    def set_samples(self, samples):
+        pass
 
-    def update(self, new_value, scale = 0):
-        self.samples.append(new_value * (10 ** scale))
-        while (len(self.samples) > self.max_samples):
-            del self.samples[0]
+#
+# The EnergyToday class gives the energy produced since midnight.
+#
+
+class EnergyToday(EnergyView):
+
+    def get(self):
+        return self.energy.total - self.energy.day_total
+
+#
+# The EnergyInterval class gives the energy produced in the previous interval of the period.
+#
 
-        Domoticz.Debug("Maximum: {} - {} values".format(self.get(), len(self.samples)))
+class EnergyInterval(EnergyView):
 
     def get(self):
-        return max(self.samples)
+        return self.energy.interval
+
+#
+# Every Device.Update is a write to the Domoticz database.
+# Noisy values would cause an update on almost every heartbeat, while the graphs hardly change.
+#
+# A deadband tells how much a value has to change before it is worth updating the device:
+# - the Absolute class uses a fixed amount, in the unit of the value.
+# - the Relative class uses a fraction of the value that was stored before.
+#
+
+class Absolute:
+
+    def __init__(self, amount):
+        self.amount = amount
+
+    def exceeded(self, old_value, new_value):
+        return abs(new_value - old_value) >= self.amount
+
+class Relative:
+
+    def __init__(self, fraction):
+        self.fraction = fraction
+
+    def exceeded(self, old_value, new_value):
+        return abs(new_value - old_value) >= abs(old_value) * self.fraction
 
 #
 # The Unit class lists all possible pieces of information that can be retrieved from the inverter.
@@ -126,28 +436,131 @@ class Maximum:
 @unique
 class Unit(IntEnum):
 
-    STATUS          = 1
-    VENDOR_STATUS   = 2
-    CURRENT         = 3
-    L1_CURRENT      = 4
-    L2_CURRENT      = 5
-    L3_CURRENT      = 6
-    L1_VOLTAGE      = 7
-    L2_VOLTAGE      = 8
-    L3_VOLTAGE      = 9
-    L1N_VOLTAGE     = 10
-    L2N_VOLTAGE     = 11
-    L3N_VOLTAGE     = 12
-    POWER_AC        = 13
-    FREQUENCY       = 14
-    POWER_APPARENT  = 15
-    POWER_REACTIVE  = 16
-    POWER_FACTOR    = 17
-    ENERGY_TOTAL    = 18
-    CURRENT_DC      = 19
-    VOLTAGE_DC      = 20
-    POWER_DC        = 21
-    TEMPERATURE     = 22
+    STATUS              = 1
+    VENDOR_STATUS       = 2
+    CURRENT             = 3
+    L1_CURRENT          = 4
+    L2_CURRENT          = 5
+    L3_CURRENT          = 6
+    L1_VOLTAGE          = 7
+    L2_VOLTAGE          = 8
+    L3_VOLTAGE          = 9
+    L1N_VOLTAGE         = 10
+    L2N_VOLTAGE         = 11
+    L3N_VOLTAGE         = 12
+    POWER_AC            = 13
+    FREQUENCY           = 14
+    POWER_APPARENT      = 15
+    POWER_REACTIVE      = 16
+    POWER_FACTOR        = 17
+    ENERGY_TOTAL        = 18
+    CURRENT_DC          = 19
+    VOLTAGE_DC          = 20
+    POWER_DC            = 21
+    TEMPERATURE         = 22
+    ENERGY_TODAY        = 23
+    ENERGY_INTERVAL     = 24
+    PHASE_IMBALANCE     = 25
+    L1_POWER_APPARENT   = 26
+    L2_POWER_APPARENT   = 27
+    L3_POWER_APPARENT   = 28
+    EFFICIENCY          = 29
+    POWER_MAXIMUM       = 30
+
+#
+# The MeterUnit and BatteryUnit classes list the information that can be retrieved from the meters and batteries.
+# Each meter and battery gets its own range of units in Domoticz; these IDs are relative to the start of that range.
+#
+
+@unique
+class MeterUnit(IntEnum):
+
+    CURRENT         = 1
+    L1_CURRENT      = 2
+    L2_CURRENT      = 3
+    L3_CURRENT      = 4
+    VOLTAGE         = 5
+    L1N_VOLTAGE     = 6
+    L2N_VOLTAGE     = 7
+    L3N_VOLTAGE     = 8
+    FREQUENCY       = 9
+    POWER           = 10
+    L1_POWER        = 11
+    L2_POWER        = 12
+    L3_POWER        = 13
+    POWER_FACTOR    = 14
+    IMPORT_ENERGY   = 15
+    EXPORT_ENERGY   = 16
+    POWER_MINIMUM   = 17
+    POWER_MAXIMUM   = 18
+    IMPORT_POWER    = 19
+    EXPORT_POWER    = 20
+
+@unique
+class BatteryUnit(IntEnum):
+
+    STATUS              = 1
+    STATE_OF_ENERGY     = 2
+    STATE_OF_HEALTH     = 3
+    AVAILABLE_ENERGY    = 4
+    CURRENT             = 5
+    VOLTAGE             = 6
+    POWER               = 7
+    TEMPERATURE         = 8
+    IMPORT_ENERGY       = 9
+    EXPORT_ENERGY       = 10
+    CHARGE_POWER        = 11
+    DISCHARGE_POWER     = 12
+
+#
+# With more than one inverter, the SiteUnit class lists the totals of all inverters together.
+#
+
+@unique
+class SiteUnit(IntEnum):
+
+    POWER_AC        = 1
+    ENERGY_TOTAL    = 2
+    POWER_DC        = 3
+    ENERGY_TODAY    = 4
+    ENERGY_INTERVAL = 5
+
+#
+# With the diagnostics option, the DiagnosticsUnit class lists how well the plugin keeps up with the inverters.
+#
+
+@unique
+class DiagnosticsUnit(IntEnum):
+
+    REQUEST_TIME        = 1
+    DECODE_TIME         = 2
+    HEARTBEAT_TIME      = 3
+    DEVICE_UPDATES      = 4
+    SKIPPED_UPDATES     = 5
+    CONNECTION_ERRORS   = 6
+    READ_LOAD           = 7
+
+#
+# The first unit of the range of units for each device.
+# The units of the inverter itself start at 0 to stay compatible with earlier versions of the plugin.
+# The follower inverters use the same table as the first one, in a range of their own.
+#
+
+UNIT_OFFSETS = {
+    "Inverter":  0,
+    "Meter1":    40,
+    "Meter2":    60,
+    "Meter3":    80,
+    "Battery1":  100,
+    "Battery2":  120,
+    "Inverter2": 140,
+    "Inverter3": 170,
+    "Inverter4": 200,
+    "Site":      230,
+    "Diagnostics": 240
+}
+
+INVERTERS = ("Inverter", "Inverter2", "Inverter3", "Inverter4")
 
 #
 # The plugin is using a few tables to setup Domoticz and to process the feedback from the inverter.
@@ -169,375 +582,2326 @@ class Column(IntEnum):
     PREPEND         = 9
     LOOKUP          = 10
     MATH            = 11
+    DEADBAND        = 12
 
+#
+# The tables are only built when they are selected for a source, and then kept.
+# So the inverter tables only load solaredge_modbus for their status maps when an inverter needs them.
 #
 # This table represents a single phase inverter.
 #
 
-SINGLE_PHASE_INVERTER = [
-#   ID,                    NAME,                TYPE,  SUBTYPE,  SWITCHTYPE, OPTIONS,                MODBUSNAME,        MODBUSSCALE,            FORMAT,    PREPEND,        LOOKUP,                                MATH
-    [Unit.STATUS,          "Status",            0xF3,  0x13,     0x00,       {},                     "status",          None,                   "{}",      None,           solaredge_modbus.INVERTER_STATUS_MAP,  None      ],
-    [Unit.VENDOR_STATUS,   "Vendor Status",     0xF3,  0x13,     0x00,       {},                     "vendor_status",   None,                   "{}",      None,           None,                                  None      ],
-    [Unit.CURRENT,         "Current",           0xF3,  0x17,     0x00,       {},                     "current",         "current_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L1_CURRENT,      "L1 Current",        0xF3,  0x17,     0x00,       {},                     "l1_current",      "current_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L1_VOLTAGE,      "L1 Voltage",        0xF3,  0x08,     0x00,       {},                     "l1_voltage",      "voltage_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L1N_VOLTAGE,     "L1-N Voltage",      0xF3,  0x08,     0x00,       {},                     "l1n_voltage",     "voltage_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_AC,        "Power",             0xF8,  0x01,     0x00,       {},                     "power_ac",        "power_ac_scale",       "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.FREQUENCY,       "Frequency",         0xF3,  0x1F,     0x00,       { "Custom": "1;Hz"  },  "frequency",       "frequency_scale",      "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_APPARENT,  "Power (Apparent)",  0xF3,  0x1F,     0x00,       { "Custom": "1;VA"  },  "power_apparent",  "power_apparent_scale", "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_REACTIVE,  "Power (Reactive)",  0xF3,  0x1F,     0x00,       { "Custom": "1;VAr" },  "power_reactive",  "power_reactive_scale", "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_FACTOR,    "Power Factor",      0xF3,  0x06,     0x00,       {},                     "power_factor",    "power_factor_scale",   "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.ENERGY_TOTAL,    "Total Energy",      0xF3,  0x1D,     0x04,       {},                     "energy_total",    "energy_total_scale",   "{};{}",   Unit.POWER_AC,  None,                                  None      ],
-    [Unit.CURRENT_DC,      "DC Current",        0xF3,  0x17,     0x00,       {},                     "current_dc",      "current_dc_scale",     "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.VOLTAGE_DC,      "DC Voltage",        0xF3,  0x08,     0x00,       {},                     "voltage_dc",      "voltage_dc_scale",     "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_DC,        "DC Power",          0xF8,  0x01,     0x00,       {},                     "power_dc",        "power_dc_scale",       "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.TEMPERATURE,     "Temperature",       0xF3,  0x05,     0x00,       {},                     "temperature",     "temperature_scale",    "{:.2f}",  None,           None,                                  Maximum() ]
-]
+@lru_cache(maxsize=None)
+def single_phase_inverter_table():
+    load_modbus()
+
+    return [
+    #   ID,                     NAME,                TYPE,  SUBTYPE,  SWITCHTYPE,  OPTIONS,                MODBUSNAME,        MODBUSSCALE,             FORMAT,    PREPEND,        LOOKUP,                                MATH                                           DEADBAND
+        [Unit.STATUS,           "Status",            0xF3,  0x13,     0x00,        {},                     "status",          None,                    "{}",      None,           solaredge_modbus.INVERTER_STATUS_MAP,  None,                                          None           ],
+        [Unit.VENDOR_STATUS,    "Vendor Status",     0xF3,  0x13,     0x00,        {},                     "vendor_status",   None,                    "{}",      None,           None,                                  None,                                          None           ],
+        [Unit.CURRENT,          "Current",           0xF3,  0x17,     0x00,        {},                     "current",         "current_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.1)  ],
+        [Unit.L1_CURRENT,       "L1 Current",        0xF3,  0x17,     0x00,        {},                     "l1_current",      "current_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.1)  ],
+        [Unit.L1_VOLTAGE,       "L1 Voltage",        0xF3,  0x08,     0x00,        {},                     "l1_voltage",      "voltage_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.L1N_VOLTAGE,      "L1-N Voltage",      0xF3,  0x08,     0x00,        {},                     "l1n_voltage",     "voltage_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.POWER_AC,         "Power",             0xF8,  0x01,     0x00,        {},                     "power_ac",        "power_ac_scale",        "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.FREQUENCY,        "Frequency",         0xF3,  0x1F,     0x00,        { "Custom": "1;Hz"  },  "frequency",       "frequency_scale",       "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.02) ],
+        [Unit.POWER_APPARENT,   "Power (Apparent)",  0xF3,  0x1F,     0x00,        { "Custom": "1;VA"  },  "power_apparent",  "power_apparent_scale",  "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.POWER_REACTIVE,   "Power (Reactive)",  0xF3,  0x1F,     0x00,        { "Custom": "1;VAr" },  "power_reactive",  "power_reactive_scale",  "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.POWER_FACTOR,     "Power Factor",      0xF3,  0x06,     0x00,        {},                     "power_factor",    "power_factor_scale",    "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.ENERGY_TOTAL,     "Total Energy",      0xF3,  0x1D,     0x04,        {},                     "energy_total",    "energy_total_scale",    "{};{}",   Unit.POWER_AC,  None,                                  Energy("power_ac", "power_ac_scale"),          None           ],
+        [Unit.CURRENT_DC,       "DC Current",        0xF3,  0x17,     0x00,        {},                     "current_dc",      "current_dc_scale",      "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.1)  ],
+        [Unit.VOLTAGE_DC,       "DC Voltage",        0xF3,  0x08,     0x00,        {},                     "voltage_dc",      "voltage_dc_scale",      "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.POWER_DC,         "DC Power",          0xF8,  0x01,     0x00,        {},                     "power_dc",        "power_dc_scale",        "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.TEMPERATURE,      "Temperature",       0xF3,  0x05,     0x00,        {},                     "temperature",     "temperature_scale",     "{:.2f}",  None,           None,                                  Maximum(),                                     Absolute(0.5)  ],
+        [Unit.ENERGY_TODAY,     "Today Energy",      0xF3,  0x1F,     0x00,        { "Custom": "1;Wh"  },  "energy_total",    "energy_total_scale",    "{:.2f}",  None,           None,                                  EnergyToday(),                                 Absolute(10)   ],
+        [Unit.ENERGY_INTERVAL,  "Interval Energy",   0xF3,  0x1F,     0x00,        { "Custom": "1;Wh"  },  "energy_total",    "energy_total_scale",    "{:.2f}",  None,           None,                                  EnergyInterval(),                              None           ],
+        [Unit.EFFICIENCY,       "Efficiency",        0xF3,  0x06,     0x00,        {},                     "efficiency",      None,                    "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.POWER_MAXIMUM,    "Power (Maximum)",   0xF8,  0x01,     0x00,        {},                     "power_ac",        "power_ac_scale",        "{:.2f}",  None,           None,                                  Maximum(),                                     Relative(0.01) ]
+    ]
 
 #
 # This table represents a three phase inverter.
 #
 
-THREE_PHASE_INVERTER = [
-#   ID,                    NAME,                TYPE,  SUBTYPE,  SWITCHTYPE, OPTIONS,                MODBUSNAME,        MODBUSSCALE,            FORMAT,    PREPEND,        LOOKUP,                                MATH
-    [Unit.STATUS,          "Status",            0xF3,  0x13,     0x00,       {},                     "status",          None,                   "{}",      None,           solaredge_modbus.INVERTER_STATUS_MAP,  None      ],
-    [Unit.VENDOR_STATUS,   "Vendor Status",     0xF3,  0x13,     0x00,       {},                     "vendor_status",   None,                   "{}",      None,           None,                                  None      ],
-    [Unit.CURRENT,         "Current",           0xF3,  0x17,     0x00,       {},                     "current",         "current_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L1_CURRENT,      "L1 Current",        0xF3,  0x17,     0x00,       {},                     "l1_current",      "current_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L2_CURRENT,      "L2 Current",        0xF3,  0x17,     0x00,       {},                     "l2_current",      "current_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L3_CURRENT,      "L3 Current",        0xF3,  0x17,     0x00,       {},                     "l3_current",      "current_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L1_VOLTAGE,      "L1 Voltage",        0xF3,  0x08,     0x00,       {},                     "l1_voltage",      "voltage_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L2_VOLTAGE,      "L2 Voltage",        0xF3,  0x08,     0x00,       {},                     "l2_voltage",      "voltage_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L3_VOLTAGE,      "L3 Voltage",        0xF3,  0x08,     0x00,       {},                     "l3_voltage",      "voltage_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L1N_VOLTAGE,     "L1-N Voltage",      0xF3,  0x08,     0x00,       {},                     "l1n_voltage",     "voltage_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L2N_VOLTAGE,     "L2-N Voltage",      0xF3,  0x08,     0x00,       {},                     "l2n_voltage",     "voltage_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.L3N_VOLTAGE,     "L3-N Voltage",      0xF3,  0x08,     0x00,       {},                     "l3n_voltage",     "voltage_scale",        "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_AC,        "Power",             0xF8,  0x01,     0x00,       {},                     "power_ac",        "power_ac_scale",       "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.FREQUENCY,       "Frequency",         0xF3,  0x1F,     0x00,       { "Custom": "1;Hz"  },  "frequency",       "frequency_scale",      "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_APPARENT,  "Power (Apparent)",  0xF3,  0x1F,     0x00,       { "Custom": "1;VA"  },  "power_apparent",  "power_apparent_scale", "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_REACTIVE,  "Power (Reactive)",  0xF3,  0x1F,     0x00,       { "Custom": "1;VAr" },  "power_reactive",  "power_reactive_scale", "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_FACTOR,    "Power Factor",      0xF3,  0x06,     0x00,       {},                     "power_factor",    "power_factor_scale",   "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.ENERGY_TOTAL,    "Total Energy",      0xF3,  0x1D,     0x04,       {},                     "energy_total",    "energy_total_scale",   "{};{}",   Unit.POWER_AC,  None,                                  None      ],
-    [Unit.CURRENT_DC,      "DC Current",        0xF3,  0x17,     0x00,       {},                     "current_dc",      "current_dc_scale",     "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.VOLTAGE_DC,      "DC Voltage",        0xF3,  0x08,     0x00,       {},                     "voltage_dc",      "voltage_dc_scale",     "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.POWER_DC,        "DC Power",          0xF8,  0x01,     0x00,       {},                     "power_dc",        "power_dc_scale",       "{:.2f}",  None,           None,                                  Average() ],
-    [Unit.TEMPERATURE,     "Temperature",       0xF3,  0x05,     0x00,       {},                     "temperature",     "temperature_scale",    "{:.2f}",  None,           None,                                  Maximum() ]
-]
+@lru_cache(maxsize=None)
+def three_phase_inverter_table():
+    load_modbus()
+
+    return [
+    #   ID,                       NAME,                   TYPE,  SUBTYPE,  SWITCHTYPE,  OPTIONS,                MODBUSNAME,           MODBUSSCALE,             FORMAT,    PREPEND,        LOOKUP,                                MATH                                           DEADBAND
+        [Unit.STATUS,             "Status",               0xF3,  0x13,     0x00,        {},                     "status",             None,                    "{}",      None,           solaredge_modbus.INVERTER_STATUS_MAP,  None,                                          None           ],
+        [Unit.VENDOR_STATUS,      "Vendor Status",        0xF3,  0x13,     0x00,        {},                     "vendor_status",      None,                    "{}",      None,           None,                                  None,                                          None           ],
+        [Unit.CURRENT,            "Current",              0xF3,  0x17,     0x00,        {},                     "current",            "current_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.1)  ],
+        [Unit.L1_CURRENT,         "L1 Current",           0xF3,  0x17,     0x00,        {},                     "l1_current",         "current_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.1)  ],
+        [Unit.L2_CURRENT,         "L2 Current",           0xF3,  0x17,     0x00,        {},                     "l2_current",         "current_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.1)  ],
+        [Unit.L3_CURRENT,         "L3 Current",           0xF3,  0x17,     0x00,        {},                     "l3_current",         "current_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.1)  ],
+        [Unit.L1_VOLTAGE,         "L1 Voltage",           0xF3,  0x08,     0x00,        {},                     "l1_voltage",         "voltage_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.L2_VOLTAGE,         "L2 Voltage",           0xF3,  0x08,     0x00,        {},                     "l2_voltage",         "voltage_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.L3_VOLTAGE,         "L3 Voltage",           0xF3,  0x08,     0x00,        {},                     "l3_voltage",         "voltage_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.L1N_VOLTAGE,        "L1-N Voltage",         0xF3,  0x08,     0x00,        {},                     "l1n_voltage",        "voltage_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.L2N_VOLTAGE,        "L2-N Voltage",         0xF3,  0x08,     0x00,        {},                     "l2n_voltage",        "voltage_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.L3N_VOLTAGE,        "L3-N Voltage",         0xF3,  0x08,     0x00,        {},                     "l3n_voltage",        "voltage_scale",         "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.POWER_AC,           "Power",                0xF8,  0x01,     0x00,        {},                     "power_ac",           "power_ac_scale",        "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.FREQUENCY,          "Frequency",            0xF3,  0x1F,     0x00,        { "Custom": "1;Hz"  },  "frequency",          "frequency_scale",       "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.02) ],
+        [Unit.POWER_APPARENT,     "Power (Apparent)",     0xF3,  0x1F,     0x00,        { "Custom": "1;VA"  },  "power_apparent",     "power_apparent_scale",  "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.POWER_REACTIVE,     "Power (Reactive)",     0xF3,  0x1F,     0x00,        { "Custom": "1;VAr" },  "power_reactive",     "power_reactive_scale",  "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.POWER_FACTOR,       "Power Factor",         0xF3,  0x06,     0x00,        {},                     "power_factor",       "power_factor_scale",    "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.ENERGY_TOTAL,       "Total Energy",         0xF3,  0x1D,     0x04,        {},                     "energy_total",       "energy_total_scale",    "{};{}",   Unit.POWER_AC,  None,                                  Energy("power_ac", "power_ac_scale"),          None           ],
+        [Unit.CURRENT_DC,         "DC Current",           0xF3,  0x17,     0x00,        {},                     "current_dc",         "current_dc_scale",      "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.1)  ],
+        [Unit.VOLTAGE_DC,         "DC Voltage",           0xF3,  0x08,     0x00,        {},                     "voltage_dc",         "voltage_dc_scale",      "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.POWER_DC,           "DC Power",             0xF8,  0x01,     0x00,        {},                     "power_dc",           "power_dc_scale",        "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.TEMPERATURE,        "Temperature",          0xF3,  0x05,     0x00,        {},                     "temperature",        "temperature_scale",     "{:.2f}",  None,           None,                                  Maximum(),                                     Absolute(0.5)  ],
+        [Unit.ENERGY_TODAY,       "Today Energy",         0xF3,  0x1F,     0x00,        { "Custom": "1;Wh"  },  "energy_total",       "energy_total_scale",    "{:.2f}",  None,           None,                                  EnergyToday(),                                 Absolute(10)   ],
+        [Unit.ENERGY_INTERVAL,    "Interval Energy",      0xF3,  0x1F,     0x00,        { "Custom": "1;Wh"  },  "energy_total",       "energy_total_scale",    "{:.2f}",  None,           None,                                  EnergyInterval(),                              None           ],
+        [Unit.PHASE_IMBALANCE,    "Phase Imbalance",      0xF3,  0x06,     0x00,        {},                     "phase_imbalance",    None,                    "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.L1_POWER_APPARENT,  "L1 Power (Apparent)",  0xF3,  0x1F,     0x00,        { "Custom": "1;VA"  },  "l1_power_apparent",  None,                    "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.L2_POWER_APPARENT,  "L2 Power (Apparent)",  0xF3,  0x1F,     0x00,        { "Custom": "1;VA"  },  "l2_power_apparent",  None,                    "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.L3_POWER_APPARENT,  "L3 Power (Apparent)",  0xF3,  0x1F,     0x00,        { "Custom": "1;VA"  },  "l3_power_apparent",  None,                    "{:.2f}",  None,           None,                                  Average(),                                     Relative(0.01) ],
+        [Unit.EFFICIENCY,         "Efficiency",           0xF3,  0x06,     0x00,        {},                     "efficiency",         None,                    "{:.2f}",  None,           None,                                  Average(),                                     Absolute(0.5)  ],
+        [Unit.POWER_MAXIMUM,      "Power (Maximum)",      0xF8,  0x01,     0x00,        {},                     "power_ac",           "power_ac_scale",        "{:.2f}",  None,           None,                                  Maximum(),                                     Relative(0.01) ]
+    ]
 
 #
-# The BasePlugin is the actual Domoticz plugin.
-# This is where the fun starts :-)
+# This table represents a meter connected to the inverter.
 #
 
-class BasePlugin:
+@lru_cache(maxsize=None)
+def meter_table():
+    return [
+    #   ID,                       NAME,               TYPE,  SUBTYPE,  SWITCHTYPE,  OPTIONS,               MODBUSNAME,              MODBUSSCALE,            FORMAT,    PREPEND,                 LOOKUP,  MATH,       DEADBAND
+        [MeterUnit.CURRENT,        "Current",          0xF3,  0x17,     0x00,        {},                    "current",               "current_scale",        "{:.2f}",  None,                    None,    Average(),  Absolute(0.1)  ],
+        [MeterUnit.L1_CURRENT,     "L1 Current",       0xF3,  0x17,     0x00,        {},                    "l1_current",            "current_scale",        "{:.2f}",  None,                    None,    Average(),  Absolute(0.1)  ],
+        [MeterUnit.L2_CURRENT,     "L2 Current",       0xF3,  0x17,     0x00,        {},                    "l2_current",            "current_scale",        "{:.2f}",  None,                    None,    Average(),  Absolute(0.1)  ],
+        [MeterUnit.L3_CURRENT,     "L3 Current",       0xF3,  0x17,     0x00,        {},                    "l3_current",            "current_scale",        "{:.2f}",  None,                    None,    Average(),  Absolute(0.1)  ],
+        [MeterUnit.VOLTAGE,        "Voltage",          0xF3,  0x08,     0x00,        {},                    "voltage_ln",            "voltage_scale",        "{:.2f}",  None,                    None,    Average(),  Absolute(0.5)  ],
+        [MeterUnit.L1N_VOLTAGE,    "L1-N Voltage",     0xF3,  0x08,     0x00,        {},                    "l1n_voltage",           "voltage_scale",        "{:.2f}",  None,                    None,    Average(),  Absolute(0.5)  ],
+        [MeterUnit.L2N_VOLTAGE,    "L2-N Voltage",     0xF3,  0x08,     0x00,        {},                    "l2n_voltage",           "voltage_scale",        "{:.2f}",  None,                    None,    Average(),  Absolute(0.5)  ],
+        [MeterUnit.L3N_VOLTAGE,    "L3-N Voltage",     0xF3,  0x08,     0x00,        {},                    "l3n_voltage",           "voltage_scale",        "{:.2f}",  None,                    None,    Average(),  Absolute(0.5)  ],
+        [MeterUnit.FREQUENCY,      "Frequency",        0xF3,  0x1F,     0x00,        { "Custom": "1;Hz" },  "frequency",             "frequency_scale",      "{:.2f}",  None,                    None,    Average(),  Absolute(0.02) ],
+        [MeterUnit.POWER,          "Power",            0xF8,  0x01,     0x00,        {},                    "power",                 "power_scale",          "{:.2f}",  None,                    None,    Average(),  Relative(0.01) ],
+        [MeterUnit.L1_POWER,       "L1 Power",         0xF8,  0x01,     0x00,        {},                    "l1_power",              "power_scale",          "{:.2f}",  None,                    None,    Average(),  Relative(0.01) ],
+        [MeterUnit.L2_POWER,       "L2 Power",         0xF8,  0x01,     0x00,        {},                    "l2_power",              "power_scale",          "{:.2f}",  None,                    None,    Average(),  Relative(0.01) ],
+        [MeterUnit.L3_POWER,       "L3 Power",         0xF8,  0x01,     0x00,        {},                    "l3_power",              "power_scale",          "{:.2f}",  None,                    None,    Average(),  Relative(0.01) ],
+        [MeterUnit.POWER_FACTOR,   "Power Factor",     0xF3,  0x06,     0x00,        {},                    "power_factor",          "power_factor_scale",   "{:.2f}",  None,                    None,    Average(),  Absolute(0.5)  ],
+        [MeterUnit.IMPORT_ENERGY,  "Imported Energy",  0xF3,  0x1D,     0x00,        {},                    "import_energy_active",  "energy_active_scale",  "{};{}",   MeterUnit.IMPORT_POWER,  None,    None,       None           ],
+        [MeterUnit.EXPORT_ENERGY,  "Exported Energy",  0xF3,  0x1D,     0x04,        {},                    "export_energy_active",  "energy_active_scale",  "{};{}",   MeterUnit.EXPORT_POWER,  None,    None,       None           ],
+        [MeterUnit.POWER_MINIMUM,  "Power (Minimum)",  0xF8,  0x01,     0x00,        {},                    "power",                 "power_scale",          "{:.2f}",  None,                    None,    Minimum(),  Relative(0.01) ],
+        [MeterUnit.POWER_MAXIMUM,  "Power (Maximum)",  0xF8,  0x01,     0x00,        {},                    "power",                 "power_scale",          "{:.2f}",  None,                    None,    Maximum(),  Relative(0.01) ],
+        [MeterUnit.IMPORT_POWER,   "Import Power",     0xF8,  0x01,     0x00,        {},                    "import_power",          None,                   "{:.2f}",  None,                    None,    Average(),  Relative(0.01) ],
+        [MeterUnit.EXPORT_POWER,   "Export Power",     0xF8,  0x01,     0x00,        {},                    "export_power",          None,                   "{:.2f}",  None,                    None,    Average(),  Relative(0.01) ]
+    ]
 
-    def __init__(self):
+#
+# This table represents a battery connected to the inverter.
+#
 
-        # The _LOOKUP_TABLE will point to one of the tables above, depending on the type of inverter.
+@lru_cache(maxsize=None)
+def battery_table():
+    load_modbus()
+
+    return [
+    #   ID,                            NAME,                 TYPE,  SUBTYPE,  SWITCHTYPE,  OPTIONS,               MODBUSNAME,                        MODBUSSCALE,  FORMAT,    PREPEND,                      LOOKUP,                               MATH,       DEADBAND
+        [BatteryUnit.STATUS,            "Status",             0xF3,  0x13,     0x00,        {},                    "status",                          None,         "{}",      None,                         solaredge_modbus.BATTERY_STATUS_MAP,  None,       None           ],
+        [BatteryUnit.STATE_OF_ENERGY,   "State of Energy",    0xF3,  0x06,     0x00,        {},                    "soe",                             None,         "{:.2f}",  None,                         None,                                 None,       Absolute(0.5)  ],
+        [BatteryUnit.STATE_OF_HEALTH,   "State of Health",    0xF3,  0x06,     0x00,        {},                    "soh",                             None,         "{:.2f}",  None,                         None,                                 None,       Absolute(0.5)  ],
+        [BatteryUnit.AVAILABLE_ENERGY,  "Available Energy",   0xF3,  0x1F,     0x00,        { "Custom": "1;Wh" },  "available_energy",                None,         "{:.2f}",  None,                         None,                                 None,       Relative(0.01) ],
+        [BatteryUnit.CURRENT,           "Current",            0xF3,  0x17,     0x00,        {},                    "instantaneous_current",           None,         "{:.2f}",  None,                         None,                                 Average(),  Absolute(0.1)  ],
+        [BatteryUnit.VOLTAGE,           "Voltage",            0xF3,  0x08,     0x00,        {},                    "instantaneous_voltage",           None,         "{:.2f}",  None,                         None,                                 Average(),  Absolute(0.5)  ],
+        [BatteryUnit.POWER,             "Power",              0xF8,  0x01,     0x00,        {},                    "instantaneous_power",             None,         "{:.2f}",  None,                         None,                                 Average(),  Relative(0.01) ],
+        [BatteryUnit.TEMPERATURE,       "Temperature",        0xF3,  0x05,     0x00,        {},                    "average_temperature",             None,         "{:.2f}",  None,                         None,                                 Maximum(),  Absolute(0.5)  ],
+        [BatteryUnit.IMPORT_ENERGY,     "Charged Energy",     0xF3,  0x1D,     0x00,        {},                    "lifetime_import_energy_counter",  None,         "{};{}",   BatteryUnit.CHARGE_POWER,     None,                                 None,       None           ],
+        [BatteryUnit.EXPORT_ENERGY,     "Discharged Energy",  0xF3,  0x1D,     0x04,        {},                    "lifetime_export_energy_counter",  None,         "{};{}",   BatteryUnit.DISCHARGE_POWER,  None,                                 None,       None           ],
+        [BatteryUnit.CHARGE_POWER,      "Charge Power",       0xF8,  0x01,     0x00,        {},                    "charge_power",                    None,         "{:.2f}",  None,                         None,                                 Average(),  Relative(0.01) ],
+        [BatteryUnit.DISCHARGE_POWER,   "Discharge Power",    0xF8,  0x01,     0x00,        {},                    "discharge_power",                 None,         "{:.2f}",  None,                         None,                                 Average(),  Relative(0.01) ]
+    ]
 
-        self._LOOKUP_TABLE = None
+#
+# This table represents the totals of all inverters.
+# The values are added up by the plugin and have already been scaled.
+#
 
-        # This is the solaredge_modbus Inverter object that will be used to communicate with the inverter.
+@lru_cache(maxsize=None)
+def site_table():
+    return [
+    #   ID,                        NAME,               TYPE,  SUBTYPE,  SWITCHTYPE,  OPTIONS,               MODBUSNAME,      MODBUSSCALE,  FORMAT,    PREPEND,            LOOKUP,  MATH,                        DEADBAND
+        [SiteUnit.POWER_AC,        "Power",            0xF8,  0x01,     0x00,        {},                    "power_ac",      None,         "{:.2f}",  None,               None,    Average(),                   Relative(0.01) ],
+        [SiteUnit.ENERGY_TOTAL,    "Total Energy",     0xF3,  0x1D,     0x04,        {},                    "energy_total",  None,         "{};{}",   SiteUnit.POWER_AC,  None,    Energy("power_ac"),          None           ],
+        [SiteUnit.POWER_DC,        "DC Power",         0xF8,  0x01,     0x00,        {},                    "power_dc",      None,         "{:.2f}",  None,               None,    Average(),                   Relative(0.01) ],
+        [SiteUnit.ENERGY_TODAY,    "Today Energy",     0xF3,  0x1F,     0x00,        { "Custom": "1;Wh" },  "energy_total",  None,         "{:.2f}",  None,               None,    EnergyToday(),               Absolute(10)   ],
+        [SiteUnit.ENERGY_INTERVAL, "Interval Energy",  0xF3,  0x1F,     0x00,        { "Custom": "1;Wh" },  "energy_total",  None,         "{:.2f}",  None,               None,    EnergyInterval(),            None           ]
+    ]
 
-        self.inverter = None
+#
+# This table represents the diagnostics of the plugin itself.
+# The values are calculated by the plugin from its Metrics on every heartbeat; the times are in milliseconds.
+#
 
-        # Default heartbeat is 10 seconds; therefore 30 samples in 5 minutes.
+@lru_cache(maxsize=None)
+def diagnostics_table():
+    return [
+    #   ID,                                  NAME,                  TYPE,  SUBTYPE,  SWITCHTYPE,  OPTIONS,                   MODBUSNAME,           MODBUSSCALE,  FORMAT,    PREPEND,  LOOKUP,  MATH,       DEADBAND
+        [DiagnosticsUnit.REQUEST_TIME,       "Modbus Request Time", 0xF3,  0x1F,     0x00,        { "Custom": "1;ms" },      "request_time",       None,         "{:.2f}",  None,     None,    Average(),  Relative(0.05) ],
+        [DiagnosticsUnit.DECODE_TIME,        "Decode Time",         0xF3,  0x1F,     0x00,        { "Custom": "1;ms" },      "decode_time",        None,         "{:.2f}",  None,     None,    Average(),  Relative(0.05) ],
+        [DiagnosticsUnit.HEARTBEAT_TIME,     "Heartbeat Time",      0xF3,  0x1F,     0x00,        { "Custom": "1;ms" },      "heartbeat_time",     None,         "{:.2f}",  None,     None,    Average(),  Relative(0.05) ],
+        [DiagnosticsUnit.DEVICE_UPDATES,     "Device Updates",      0xF3,  0x1F,     0x00,        { "Custom": "1;updates" }, "device_updates",     None,         "{:.2f}",  None,     None,    Average(),  Relative(0.05) ],
+        [DiagnosticsUnit.SKIPPED_UPDATES,    "Skipped Updates",     0xF3,  0x1F,     0x00,        { "Custom": "1;updates" }, "skipped_updates",    None,         "{:.2f}",  None,     None,    Average(),  Relative(0.05) ],
+        [DiagnosticsUnit.CONNECTION_ERRORS,  "Connection Errors",   0xF3,  0x1F,     0x00,        { "Custom": "1;errors" },  "connection_errors",  None,         "{}",      None,     None,    None,       None           ],
+        [DiagnosticsUnit.READ_LOAD,          "Read Load",           0xF3,  0x06,     0x00,        {},                        "read_load",          None,         "{:.2f}",  None,     None,    Average(),  Absolute(0.5)  ]
+    ]
 
-        self.max_samples = 30
+#
+# Most values come with a scale factor: the power of ten to multiply the value with.
+# The usual powers are looked up instead of calculated; all values are scaled by scaled().
+#
 
-        # Whether the plugin should add missing devices.
-        # If set to True, a deleted device will be added on the next restart of Domoticz.
+POWERS_OF_TEN = {scale: 10 ** scale for scale in range(-10, 11)}
 
-        self.add_devices = False
+def scaled(value, scale):
+    return value * (POWERS_OF_TEN.get(scale) or 10 ** scale)
 
-        # When there is an issue contacting the inverter, the plugin will retry after a certain retry delay.
-        # The actual time after which the plugin will try again is stored in the retry after variable.
-        # According to the documenation, the inverter may need up to 2 minutes to "reset".
+#
+# Some values in the tables are not read from the inverter, but derived from the values that are.
+# The derived values of a read are calculated together, after the registers are read, and added to its values.
+# Each derivation returns its values in one go, in the order of its names, from the registers it lists.
+# The scales cancel out of the imbalance; the other values are scaled like the registers they come from.
+# The power of a meter is negative for export and the power of a battery is positive while charging;
+# each energy counter is shown with the part of the power that flows in its direction.
+#
 
-        self.retrydelay = timedelta(minutes = 2)
-        self.retryafter = datetime.now() - timedelta(seconds = 1)
+def derive_phases(values):
+    currents = (values["l1_current"], values["l2_current"], values["l3_current"])
+    voltages = (values["l1n_voltage"], values["l2n_voltage"], values["l3n_voltage"])
+    scale = values["current_scale"] + values["voltage_scale"]
 
-    #
-    # onStart is called by Domoticz to start the processing of the plugin.
-    #
+    average = sum(currents) / 3
+    imbalance = max(abs(current - average) for current in currents) / average * 100 if average > 0 else 0
 
-    def onStart(self):
+    return (imbalance,) + tuple(scaled(voltage * current, scale) for (voltage, current) in zip(voltages, currents))
 
-        self.add_devices = bool(Parameters["Mode1"])
+def derive_meter_flows(values):
+    power = scaled(values["power"], values["power_scale"])
+    return (max(0, power), max(0, -power))
 
-        # Domoticz will generate graphs showing an interval of 5 minutes.
-        # Calculate the number of samples to store over a period of 5 minutes.
+def derive_battery_flows(values):
+    power = values["instantaneous_power"]
+    return (max(0, power), max(0, -power))
 
-        self.max_samples = 300 / int(Parameters["Mode2"])
+def derive_efficiency(values):
+    power_ac = scaled(values["power_ac"], values["power_ac_scale"])
+    power_dc = scaled(values["power_dc"], values["power_dc_scale"])
+    return (power_ac / power_dc * 100 if power_dc > 0 else 0,)
 
-        # Now set the interval at which the information is collected accordingly.
+DERIVED_VALUES = [
+#   FUNCTION,               NAMES,                                                                               REGISTERS
+    (derive_phases,         ("phase_imbalance", "l1_power_apparent", "l2_power_apparent", "l3_power_apparent"),  ("l1_current", "l2_current", "l3_current", "current_scale", "l1n_voltage", "l2n_voltage", "l3n_voltage", "voltage_scale")),
+    (derive_efficiency,     ("efficiency",),                                                                     ("power_ac", "power_ac_scale", "power_dc", "power_dc_scale")),
+    (derive_meter_flows,    ("import_power", "export_power"),                                                    ("power", "power_scale")),
+    (derive_battery_flows,  ("charge_power", "discharge_power"),                                                 ("instantaneous_power",))
+]
 
-        Domoticz.Heartbeat(int(Parameters["Mode2"]))
+#
+# The registers each inverter has to provide to calculate the site totals.
+#
+
+SITE_REGISTERS = {
+    "power_ac":     "power_ac_scale",
+    "energy_total": "energy_total_scale",
+    "power_dc":     "power_dc_scale"
+}
+
+#
+# The table for each supported type of inverter, by SunSpec DID.
+# The plugin currently has 2 supported types.
+# This may be updated in the future based on user feedback.
+#
+
+INVERTER_TABLES = {
+    101: single_phase_inverter_table,   # sunspecDID.SINGLE_PHASE_INVERTER
+    103: three_phase_inverter_table     # sunspecDID.THREE_PHASE_INVERTER
+}
+
+#
+# A Modbus request can read up to 125 registers at once.
+# Gaps of unused registers up to MAX_REGISTER_GAP are read along to save a round trip.
+#
+
+MAX_REGISTER_BLOCK = 125
+MAX_REGISTER_GAP = 16
+
+#
+# Domoticz calls onHeartbeat for every new set of values, so processing a unit has to be cheap.
+# A Processor is compiled from a row in one of the tables above.
+# All decisions are made upfront: it knows how to transform the value(s) from the inverter and how to format the result.
+#
 
-        if Parameters["Mode5"] == "Debug":
-            Domoticz.Debugging(1)
+class Processor:
+
+    __slots__ = ("id", "name", "modbusname", "modbusscale", "lookup", "math", "prepend", "prepended", "required", "format", "transform", "render",
+                 "deadband", "max_age", "stored_value", "stored_at")
+
+    def __init__(self, unit, offset, prefix, math_enabled, period, max_age):
+        self.id = offset + unit[Column.ID]
+        self.name = prefix + unit[Column.NAME]
+        self.modbusname = unit[Column.MODBUSNAME]
+        self.modbusscale = unit[Column.MODBUSSCALE]
+        self.lookup = unit[Column.LOOKUP]
+        self.prepend = offset + unit[Column.PREPEND] if unit[Column.PREPEND] else None
+        self.format = unit[Column.FORMAT].format
+
+        # The math object in the table serves as a template; several meters or batteries can share the same table.
+        # The energy is always integrated; the Auto Avg/Max math setting only covers the averages and maxima.
+
+        template = unit[Column.MATH]
+        self.math = template.copy() if template and (math_enabled or isinstance(template, (Energy, EnergyView))) else None
+
+        # For certain units the table has a lookup table to replace the value with something else.
+        # When a math object is setup for the unit, update the samples in it and get the calculated value.
+        # When there is no math object then just store the latest value; some values need to be scaled first.
+
+        if self.lookup:
+            self.transform = self.lookup_value
+        elif isinstance(self.math, (Energy, EnergyView)):
+            self.math.set_period(period)
+            self.transform = self.energy_value
+        elif self.math:
+            self.math.set_period(period)
+            self.transform = self.math_value
+        elif self.modbusscale:
+            self.transform = self.scaled_value
         else:
-            Domoticz.Debugging(0)
+            self.transform = self.copied_value
 
-        Domoticz.Debug(
-            "onStart Address: {} Port: {} Device Address: {}".format(
-                Parameters["Address"],
-                Parameters["Port"],
-                Parameters["Mode3"]
-            )
-        )
+        # Some devices require multiple values, in which case the plugin will combine those values.
+        # Currently, there is only a need to prepend one value with another.
+        # The other value is the one its processor stored last, so it only changes when that device was updated.
+        # The processors are linked by setupDevices; a prepended unit is required, even without a device.
 
-        self.inverter = solaredge_modbus.Inverter(
-            host=Parameters["Address"],
-            port=Parameters["Port"],
-            timeout=5,
-            unit=int(Parameters["Mode3"]) if Parameters["Mode3"] else 1
-        )
+        self.prepended = None
+        self.required = False
+
+        if self.prepend:
+            self.render = self.prepended_value
+        else:
+            self.render = self.formatted_value
+
+        # The value that was stored in the device last and when that happened.
+        # Small changes are not stored, unless the stored value gets older than the maximum age.
+
+        self.deadband = unit[Column.DEADBAND]
+        self.max_age = max_age
+        self.stored_value = None
+        self.stored_at = None
+
+    def needs_update(self, value, timestamp):
+        if self.deadband is None or self.stored_at is None:
+            return True
+        if timestamp - self.stored_at >= self.max_age:
+            return True
+        return self.deadband.exceeded(self.stored_value, value)
+
+    def stored(self, value, timestamp):
+        self.stored_value = value
+        self.stored_at = timestamp
+
+    def lookup_value(self, values, timestamp):
+        to_lookup = int(values[self.modbusname])
+
+        if to_lookup >= 0 and to_lookup < len(self.lookup):
+            return self.lookup[to_lookup]
+        else:
+            return "Key not found in lookup table: {}".format(to_lookup)
+
+    def math_value(self, values, timestamp):
+        self.math.add(self.scaled_value(values, timestamp), timestamp)
+        return self.math.get()
+
+    def energy_value(self, values, timestamp):
+        energy = self.math.energy
+        power = values[energy.power]
+        if energy.power_scale:
+            power = scaled(power, values[energy.power_scale])
+        energy.add(power, self.scaled_value(values, timestamp), timestamp)
+        return self.math.get()
+
+    def scaled_value(self, values, timestamp):
+        value = values[self.modbusname]
+        if self.modbusscale:
+            value = scaled(value, values[self.modbusscale])
+        return value
+
+    def copied_value(self, values, timestamp):
+        return values[self.modbusname]
+
+    def formatted_value(self, value):
+        return self.format(value)
+
+    def prepended_value(self, value):
+        prepended = self.prepended
+        return self.format(prepended.format(prepended.stored_value), value)
+
+#
+# The inverter does not produce anything while it is off, sleeping or on standby.
+# There is no need to read it as often then.
+#
+
+SLEEPING_STATUS = (
+    1,  # inverterStatus.I_STATUS_OFF
+    2,  # inverterStatus.I_STATUS_SLEEPING
+    8   # inverterStatus.I_STATUS_STANDBY
+)
+
+#
+# The Connection keeps the connection with the inverter open across reads and keeps track of its health.
+#
+# When reads keep on failing, the circuit "opens" and no reads are attempted for a while.
+# That time doubles with every failed attempt, with some random jitter, up to the retry delay.
+# According to the documentation, the inverter may need up to 2 minutes to "reset".
+# When the time is up, a single read is attempted; the circuit "closes" again when that read succeeds.
+#
+
+CIRCUIT_FAILURES = 3
+
+class Connection:
+
+    def __init__(self, inverter, interval, retrydelay, pipeline = False, stopping = None):
+        self.inverter = inverter
+        self.interval = interval
+        self.retrydelay = retrydelay.total_seconds()
+
+        # Each connect and request can block for the Modbus timeout; with the retries that adds up.
+        # Once the reader is stopping, no new attempts are made so it stops within a single timeout.
+
+        self.stopping = stopping or threading.Event()
 
-        # Lets get in touch with the inverter.
+        # When pipelining, all requests of a poll are sent at once and the responses are collected afterwards.
+        # The Modbus TCP transaction ID tells which response belongs to which request.
 
-        self.contactInverter()
+        self.pipeline = pipeline
+        self.transaction = 0
 
+        self.backoff = 0
+        self.retryafter = 0
+
+        # Some counters to see how healthy the connection is.
+
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.reconnects = 0
+        self.last_good_read = None
+
+    def is_open(self):
+        return self.consecutive_failures >= CIRCUIT_FAILURES
+
+    def allows(self):
+        return time.monotonic() >= self.retryafter
+
+    def since_last_good_read(self):
+        if self.last_good_read is None:
+            return None
+        return time.time() - self.last_good_read
+
+    def connect(self):
+        if not self.inverter.connected():
+            if self.last_good_read is not None:
+                self.reconnects += 1
+            if not self.inverter.connect():
+                raise ConnectionException("Unable to connect to {}:{}".format(self.inverter.host, self.inverter.port))
+
+    def read_block(self, start, length, unit):
+        for i in range(self.inverter.retries):
+            if self.stopping.is_set():
+                break
+
+            self.connect()
+            if self.stopping.is_set():
+                break
+
+            result = self.inverter.client.read_holding_registers(start, length, unit=unit)
+
+            if isinstance(result, ReadHoldingRegistersResponse) and len(result.registers) == length:
+                return result.registers
+
+        return None
 
     #
-    # OnHeartbeat is called by Domoticz at a specific interval as set in onStart()
+    # Send all (start address, number of registers, unit) requests in one go and wait for the responses.
+    # Returns the registers for each request; None for a request that was not answered properly.
     #
 
-    def onHeartbeat(self):
-        Domoticz.Debug("onHeartbeat")
+    def read_pipelined(self, requests):
+        self.connect()
+        if self.stopping.is_set():
+            return [None] * len(requests)
 
-        # We need to make sure that we have a table to work with.
-        # This will be set by contactInverter and will be None till it is clear
-        # that the inverter responds and that a matching table is available.
+        sock = self.inverter.client.socket
+        deadline = time.monotonic() + self.inverter.timeout
+        pending = {}
+        frames = []
 
-        if self._LOOKUP_TABLE:
+        for (index, (start, length, unit)) in enumerate(requests):
+            self.transaction = (self.transaction + 1) & 0xffff
+            pending[self.transaction] = (index, length)
+            frames.append(struct.pack(">HHHBBHH", self.transaction, 0, 6, unit, 3, start, length))
 
-            inverter_values = None
-            try:
-                inverter_values = self.inverter.read_all()
-            except ConnectionException:
-                inverter_values = None
-                Domoticz.Debug("ConnectionException")
-            else:
+        blocks = [None] * len(requests)
+        buffer = b""
+
+        try:
+            sock.sendall(b"".join(frames))
 
-                if inverter_values:
+            while pending:
+                sock.settimeout(max(0.001, deadline - time.monotonic()))
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise ConnectionException("Connection closed by {}:{}".format(self.inverter.host, self.inverter.port))
+                buffer += chunk
 
-                    if "Mode5" in Parameters and (Parameters["Mode5"] == "Extra" or Parameters["Mode5"] == "Debug"):
-                        to_log = inverter_values
-                        if "c_serialnumber" in to_log:
-                            to_log.pop("c_serialnumber")
-                        Domoticz.Log("inverter values: {}".format(json.dumps(to_log, indent=4, sort_keys=False)))
+                # A buffer can hold several responses, the last one possibly incomplete.
 
-                    # Just for cosmetics in the log
+                while len(buffer) >= 7:
+                    (transaction, protocol, length) = struct.unpack(">HHH", buffer[:6])
+                    if len(buffer) < 6 + length:
+                        break
 
-                    updated = 0
-                    device_count = 0
+                    pdu = buffer[7:6 + length]
+                    buffer = buffer[6 + length:]
 
-                    # Now process each unit in the table.
+                    if transaction not in pending:
+                        continue
 
-                    for unit in self._LOOKUP_TABLE:
-                        Domoticz.Debug(str(unit))
+                    (index, count) = pending.pop(transaction)
+                    if len(pdu) == 2 + count * 2 and pdu[0] == 3:
+                        blocks[index] = list(struct.unpack(">{}H".format(count), pdu[2:]))
 
-                        # Skip a unit when the matching device got deleted.
+            sock.settimeout(self.inverter.timeout)
 
-                        if unit[Column.ID] in Devices:
-                            Domoticz.Debug("-> found in Devices")
+        except OSError:
 
-                            # For certain units the table has a lookup table to replace the value with something else.
+            # Not everything was answered in time, so responses may still arrive later on.
+            # Start with a fresh socket on the next poll instead of mixing them up.
 
-                            if unit[Column.LOOKUP]:
-                                Domoticz.Debug("-> looking up...")
+            self.inverter.disconnect()
 
-                                lookup_table = unit[Column.LOOKUP]
-                                to_lookup = int(inverter_values[unit[Column.MODBUSNAME]])
+        return blocks
 
-                                if to_lookup >= 0 and to_lookup < len(lookup_table):
-                                    value = lookup_table[to_lookup]
-                                else:
-                                    value = "Key not found in lookup table: {}".format(to_lookup)
+    def succeeded(self):
+        self.consecutive_failures = 0
+        self.backoff = 0
+        self.retryafter = 0
+        self.last_good_read = time.time()
 
-                            # When a math object is setup for the unit, update the samples in it and get the calculated value.
+    def failed(self):
+        self.failures += 1
+        self.consecutive_failures += 1
 
-                            elif unit[Column.MATH] and Parameters["Mode4"] == "math_enabled":
-                                Domoticz.Debug("-> calculating...")
-                                m = unit[Column.MATH]
-                                if unit[Column.MODBUSSCALE]:
-                                    m.update(inverter_values[unit[Column.MODBUSNAME]], inverter_values[unit[Column.MODBUSSCALE]])
-                                else:
-                                    m.update(inverter_values[unit[Column.MODBUSNAME]])
+        # Start with a fresh socket on the next attempt.
 
-                                value = m.get()
+        self.inverter.disconnect()
 
-                            # When there is no math object then just store the latest value.
-                            # Some values from the inverter need to be scaled before they can be stored.
+        if self.is_open():
+            self.backoff = min(self.retrydelay, max(self.interval, self.backoff * 2))
+            self.retryafter = time.monotonic() + self.backoff * random.uniform(0.5, 1.0)
 
-                            elif unit[Column.MODBUSSCALE]:
-                                Domoticz.Debug("-> scaling...")
-                                # we need to do some calculation here
-                                value = inverter_values[unit[Column.MODBUSNAME]] * (10 ** inverter_values[unit[Column.MODBUSSCALE]])
+#
+# Meters and batteries that could not be read during discovery are tried again after DISCOVERY_RETRY seconds.
+# The delay doubles with every attempt; after DISCOVERY_ATTEMPTS attempts, discovery is done.
+#
 
-                            # Some values require no action but storing in Domoticz.
+DISCOVERY_RETRY = 60
+DISCOVERY_ATTEMPTS = 6
 
-                            else:
-                                Domoticz.Debug("-> copying...")
-                                value = inverter_values[unit[Column.MODBUSNAME]]
+#
+# Reading the inverter can take a while; a slow or dropped response blocks for up to the Modbus timeout.
+# Doing that on the Domoticz heartbeat makes the plugin unresponsive, so the InverterReader polls the
+# inverter from a background thread and keeps the latest set of values (the snapshot) available.
+#
+# Follower inverters with another unit ID on the same host share the connection of the first inverter.
+# Each host has its own reader, so inverters on different hosts are read concurrently.
+#
+# The reader thread must never call into Domoticz; onHeartbeat picks up the snapshot and does the logging.
+# The solaredge_modbus objects are created by the thread itself, so Domoticz does not wait for them to load.
+#
 
-                            Domoticz.Debug("value = {}".format(value))
+class InverterReader:
 
-                            # Time to store the value in Domoticz.
-                            # Some devices require multiple values, in which case the plugin will combine those values.
-                            # Currently, there is only a need to prepend one value with another.
+    def __init__(self, host, port, units, interval, retrydelay, sleep_interval, discover, pipeline = False):
 
-                            if unit[Column.PREPEND]:
-                                Domoticz.Debug("-> has prepend")
-                                prepend = Devices[unit[Column.PREPEND]].sValue
-                                Domoticz.Debug("prepend = {}".format(prepend))
-                                sValue = unit[Column.FORMAT].format(prepend, value)
-                            else:
-                                Domoticz.Debug("-> no prepend")
-                                sValue = unit[Column.FORMAT].format(value)
+        # The unit IDs of the inverters on the host, by source; the first one owns the connection.
+        # The solaredge_modbus Inverter object of the first one is created by load().
 
-                            Domoticz.Debug("sValue = {}".format(sValue))
+        self.host = host
+        self.port = port
+        self.units = units
+        self.source = next(iter(units))
+        self.inverter = None
+        self.timeout = 5
 
-                            # Only store the value in Domoticz when it has changed.
-                            # TODO:
-                            #   We should not store certain values when the inverter is sleeping.
-                            #   That results in a strange graph; it would be better just to skip it then.
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.connection = Connection(None, interval, retrydelay, pipeline, self.stopping)
 
-                            if sValue != Devices[unit[Column.ID]].sValue:
-                                Devices[unit[Column.ID]].Update(nValue=0, sValue=str(sValue), TimedOut=0)
-                                updated += 1
+        # While the inverter is sleeping, the time between reads doubles up to the sleep interval.
+        # As soon as the inverter wakes up, the reader goes back to the normal interval.
+        # Meters and batteries are busiest when the inverter sleeps; with one connected, the reader keeps the normal interval.
 
-                            device_count += 1
+        self.sleep_interval = max(interval, sleep_interval)
+        self.delay = interval
+        self.sleeping = False
 
-                        else:
-                            Domoticz.Debug("-> NOT found in Devices")
+        self.lock = threading.Lock()
+        self.thread = None
 
-                    Domoticz.Log("Updated {} values out of {}".format(updated, device_count))
-                else:
-                    Domoticz.Log("Inverter returned no information")
+        # The latest values read from the inverter and the devices connected to it, and the time they were read.
+        # The snapshot is handed out once; onHeartbeat will see None when nothing new was read.
 
-        # Try to contact the inverter when the lookup table is not yet initialized.
+        self.snapshot = None
+        self.timestamp = None
 
-        else:
-            self.contactInverter()
+        # The last problem the reader ran into; None when the last read was successful.
+
+        self.error = None
+
+        # Optionally, the raw registers are also stored in a RegisterCache for the ModbusProxy
+        # and written to a CaptureWriter, as (source, unit, start address, registers) blocks.
+
+        self.cache = None
+        self.capture = None
+        self.captured = []
+
+        # The time of each Modbus request and decode, and the failed reads, are kept in the Metrics.
+        # The plugin shares one Metrics object between all readers.
+
+        self.metrics = Metrics()
+
+        # The follower inverters, meters and batteries share the connection of the first inverter.
+        # Meters and batteries are discovered after the first successful read of the inverter, unless discovery is disabled.
+        # The candidates that could not be read are tried again later on; a timeout at startup should not hide them.
+
+        self.devices = {}
+        self.discovered = not discover
+        self.candidates = None
+        self.discovery_attempts = 0
+        self.discover_after = 0
 
+        # How long it took to read each device, in seconds.
+
+        self.costs = {}
+
+        # The register blocks to read for each device.
+
+        self.plans = {}
 
     #
-    # Contact the inverter and find out what type it is.
-    # Initialize the lookup table when the type is supported.
+    # Load solaredge_modbus and create the objects for the inverters on the host.
+    # Till we know which devices exist, read all registers that identify the inverter and its measurements.
+    # The power control registers (batch 3) are not used by the plugin and not supported by every inverter.
     #
-    
-    def contactInverter(self):
 
-        # Do not stress the inverter when it did not respond in the previous attempt to contact it.
+    def load(self):
+        load_modbus()
 
-        if self.retryafter <= datetime.now():
+        self.inverter = solaredge_modbus.Inverter(host=self.host, port=self.port, timeout=self.timeout, unit=self.units[self.source])
+        self.connection.inverter = self.inverter
 
-            # Here we go...
-            inverter_values = None
-            try:
-                inverter_values = self.inverter.read_all()
-            except ConnectionException:
+        for (source, unit) in islice(self.units.items(), 1, None):
+            inverter = solaredge_modbus.Inverter(parent=self.inverter)
+            inverter.unit = unit
+            self.devices[source] = inverter
+
+        for source in self.units:
+            self.set_registers(source, (name for (name, register) in self.device(source).registers.items() if register[7] < 3))
+
+    def device(self, source):
+        return self.inverter if source == self.source else self.devices[source]
+
+    #
+    # Only a few of the registers are used by the devices that exist.
+    # Group the registers of the given names into as few contiguous blocks as possible.
+    # Reading a small gap of unused registers is cheaper than another round trip to the inverter.
+    # Each block in the plan is a (start address, number of registers, [(name, register), ...]) tuple.
+    #
 
-                # There are multiple reasons why this may fail.
-                # - Perhaps the ip address or port are incorrect.
-                # - The inverter may not be connected to the networ,
-                # - The inverter may be turned off.
-                # - The inverter has a bad hairday....
-                # Try again in the future.
+    def set_registers(self, source, names):
+        device = self.device(source)
+        registers = sorted(
+            ((name, device.registers[name]) for name in set(names) if name in device.registers),
+            key=lambda register: register[1][0]
+        )
 
-                self.retryafter = datetime.now() + self.retrydelay
-                inverter_values = None
+        plan = []
+        start = end = None
 
-                Domoticz.Log("Connection Exception when trying to contact: {}:{} Device Address: {}".format(Parameters["Address"], Parameters["Port"], Parameters["Mode3"]))
-                Domoticz.Log("Retrying to communicate with inverter after: {}".format(self.retryafter))
+        for (name, register) in registers:
+            address = register[0]
+            length = register[1]
 
+            if plan and address - end <= MAX_REGISTER_GAP and address + length - start <= MAX_REGISTER_BLOCK:
+                end = max(end, address + length)
+                plan[-1] = (start, end - start, plan[-1][2] + [(name, register)])
             else:
+                start = address
+                end = address + length
+                plan.append((start, length, [(name, register)]))
 
-                if inverter_values:
-                    Domoticz.Log("Connection established with: {}:{} Device Address: {}".format(Parameters["Address"], Parameters["Port"], Parameters["Mode3"]))
-
-                    inverter_type = solaredge_modbus.sunspecDID(inverter_values["c_sunspec_did"])
-                    Domoticz.Log("Inverter type: {}".format(inverter_type))
-
-                    # The plugin currently has 2 supported types.
-                    # This may be updated in the future based on user feedback.
-
-                    if inverter_type == solaredge_modbus.sunspecDID.SINGLE_PHASE_INVERTER:
-                        self._LOOKUP_TABLE = SINGLE_PHASE_INVERTER
-                    elif inverter_type == solaredge_modbus.sunspecDID.THREE_PHASE_INVERTER:
-                        self._LOOKUP_TABLE = THREE_PHASE_INVERTER
-                    else:
-                        Domoticz.Log("Unsupported inverter type: {}".format(inverter_type))
-
-                    if self._LOOKUP_TABLE:
-
-                        # Set the number of samples on all the math objects.
-
-                        for unit in self._LOOKUP_TABLE:
-                            if unit[Column.MATH]  and Parameters["Mode4"] == "math_enabled":
-                                unit[Column.MATH].set_max_samples(self.max_samples)
-
-
-                        # We updated some device types over time.
-                        # Let's make sure that we have the correct type setup.
-
-                        for unit in self._LOOKUP_TABLE:
-                            if unit[Column.ID] in Devices:
-                                device = Devices[unit[Column.ID]]
-                                
-                                if (device.Type != unit[Column.TYPE] or
-                                    device.SubType != unit[Column.SUBTYPE] or
-                                    device.SwitchType != unit[Column.SWITCHTYPE] or
-                                    device.Options != unit[Column.OPTIONS]):
-
-                                    Domoticz.Log("Updating device \"{}\"".format(device.Name))
-
-                                    nValue = device.nValue
-                                    sValue = device.sValue
-
-                                    device.Update(
-                                            Type=unit[Column.TYPE],
-                                            Subtype=unit[Column.SUBTYPE],
-                                            Switchtype=unit[Column.SWITCHTYPE],
-                                            Options=unit[Column.OPTIONS],
-                                            nValue=nValue,
-                                            sValue=sValue
-                                    )
-
-                        # Add missing devices if needed.
-
-                        if self.add_devices:
-                            for unit in self._LOOKUP_TABLE:
-                                if unit[Column.ID] not in Devices:
-                                    Domoticz.Device(
-                                        Unit=unit[Column.ID],
-                                        Name=unit[Column.NAME],
-                                        Type=unit[Column.TYPE],
-                                        Subtype=unit[Column.SUBTYPE],
-                                        Switchtype=unit[Column.SWITCHTYPE],
-                                        Options=unit[Column.OPTIONS],
-                                        Used=1,
-                                    ).Create()
-                else:
-                    Domoticz.Log("Connection established with: {}:{} Device Address: {}. BUT... inverter returned no information".format(Parameters["Address"], Parameters["Port"], Parameters["Mode3"]))
-                    Domoticz.Log("Retrying to communicate with inverter after: {}".format(self.retryafter))
-        else:
-            Domoticz.Log("Retrying to communicate with inverter after: {}".format(self.retryafter))
+        self.plans[source] = plan
 
+    #
+    # Decode the blocks of registers read for a device, in the order of its plan.
+    # All values are needed to process a snapshot; a partial read is no read at all.
+    # So the blocks are only captured once all of them were decoded.
+    #
 
-#
-# Instantiate the plugin and register the supported callbacks.
-# Currently that is only onStart() and onHeartbeat()
-#
+    def decode(self, source, blocks):
+        device = self.device(source)
+        values = {}
+        captured = []
+        started = time.perf_counter()
 
-global _plugin
-_plugin = BasePlugin()
+        for ((start, length, registers), block) in zip(self.plans[source], blocks):
+            if block is None:
+                return None
 
-def onStart():
-    global _plugin
-    _plugin.onStart()
+            if self.cache:
+                self.cache.update(device.unit, start, block)
+
+            captured.append((source, device.unit, start, block))
+
+            decoder = BinaryPayloadDecoder.fromRegisters(block, byteorder=Endian.Big, wordorder=device.wordorder)
+            offset = start
+
+            for (name, register) in registers:
+                address = register[0]
+                if address > offset:
+                    decoder.skip_bytes((address - offset) * 2)
+                    offset = address
+
+                values[name] = device._decode_value(decoder, register[1], register[3], register[4])
+                offset += register[1]
+
+        if self.capture:
+            self.captured.extend(captured)
+
+        self.metrics.observe("decode_seconds", time.perf_counter() - started)
+        return values
+
+    def read_device(self, source):
+        device = self.device(source)
+        started = time.perf_counter()
+        blocks = []
+
+        for (start, length, registers) in self.plans[source]:
+            before = time.perf_counter()
+            block = self.connection.read_block(start, length, device.unit)
+            self.metrics.observe("modbus_request_seconds", time.perf_counter() - before)
+            self.metrics.increment("modbus_requests_total")
+
+            blocks.append(block)
+            if block is None:
+                break
+
+        self.costs[source] = time.perf_counter() - started
+        return self.decode(source, blocks)
+
+    #
+    # Read several devices over the shared connection.
+    # Without pipelining, each request waits for the previous response; the devices after a failed first one are skipped.
+    # With pipelining, all requests are sent at once, so the poll takes about one round trip regardless of the number of devices.
+    #
+
+    def read_devices(self, sources):
+        snapshot = {}
+
+        if not self.connection.pipeline:
+            for source in sources:
+                values = self.read_device(source)
+                if values:
+                    snapshot[source] = values
+                elif source == self.source:
+                    break
+
+            return snapshot
+
+        requests = [(source, start, length) for source in sources for (start, length, registers) in self.plans[source]]
+
+        started = time.perf_counter()
+        blocks = self.connection.read_pipelined([(start, length, self.device(source).unit) for (source, start, length) in requests])
+        cost = time.perf_counter() - started
+
+        # The requests were answered at the same time; the time of the whole batch counts as one round trip.
+
+        self.metrics.observe("modbus_request_seconds", cost)
+        self.metrics.increment("modbus_requests_total", len(requests))
+
+        index = 0
+        for source in sources:
+            count = len(self.plans[source])
+            values = self.decode(source, blocks[index:index + count])
+            index += count
+
+            self.costs[source] = cost
+            if values:
+                snapshot[source] = values
+
+        return snapshot
+
+    #
+    # Find the meters and batteries connected to the inverter.
+    # Only keep the ones that can actually be read and that identify themselves.
+    # A candidate that could not be read is tried again after the next good read of the inverter,
+    # with a doubling delay, up to DISCOVERY_ATTEMPTS times; one that identifies as nothing is dropped.
+    # Returns the values of the devices that were found.
+    #
+
+    def discover(self):
+        if self.candidates is None:
+            self.candidates = {}
+            self.candidates.update(self.inverter.meters())
+            self.candidates.update(self.inverter.batteries())
+
+        found = {}
+
+        for (source, device) in list(self.candidates.items()):
+            if source not in UNIT_OFFSETS:
+                del self.candidates[source]
+                continue
+
+            self.devices[source] = device
+            self.set_registers(source, (name for (name, register) in device.registers.items() if register[7] < 3))
+
+            values = self.read_device(source)
+            if values is not None:
+                del self.candidates[source]
+
+            if values and values.get("c_sunspec_did"):
+                found[source] = values
+            else:
+                del self.devices[source]
+                del self.plans[source]
+                del self.costs[source]
+                self.captured = [block for block in self.captured if block[0] != source]
+
+        self.discovery_attempts += 1
+        if not self.candidates or self.discovery_attempts >= DISCOVERY_ATTEMPTS:
+            self.discovered = True
+        else:
+            self.discover_after = time.monotonic() + DISCOVERY_RETRY * 2 ** (self.discovery_attempts - 1)
+
+        return found
+
+    #
+    # Read the inverters and the devices connected to them in one go.
+    # The snapshot has the values of each device; a device that could not be read is left out.
+    # Without the values of the first inverter there is no snapshot at all.
+    #
+
+    def read(self):
+        self.captured = []
+        snapshot = self.read_devices([self.source] + list(self.devices))
+        if self.source not in snapshot:
+            return None
+
+        if not self.discovered and time.monotonic() >= self.discover_after:
+            snapshot.update(self.discover())
+
+        return snapshot
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(name="SolarEdgeReader", target=self.run, daemon=True)
+        self.thread.start()
+
+    #
+    # A read that is in progress is not interrupted, but no new connect or request is started once stopping.
+    # So the thread ends within one Modbus timeout.
+    #
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout=self.timeout + 1)
+            self.thread = None
+
+        if self.inverter:
+            self.inverter.disconnect()
+
+    def take(self):
+        with self.lock:
+            snapshot = self.snapshot
+            timestamp = self.timestamp
+            self.snapshot = None
+
+        return (timestamp, snapshot)
+
+    def poll(self):
+        values = self.read()
+        if not values:
+            self.error = "Inverter returned no information"
+            self.failed()
+            return
+
+        self.connection.succeeded()
+        with self.lock:
+            self.snapshot = values
+            self.timestamp = time.time()
+        self.error = None
+
+        if self.capture:
+            self.capture.write(self.timestamp, self.captured)
+
+        self.sleeping = all(values[source].get("status") in SLEEPING_STATUS for source in values if source in INVERTERS)
+        if self.sleeping and all(source in INVERTERS for source in self.devices):
+            self.delay = min(self.delay * 2, self.sleep_interval)
+        else:
+            self.delay = self.interval
+
+    def failed(self):
+        self.connection.failed()
+        self.metrics.increment("modbus_errors_total")
+
+    def run(self):
+        try:
+            self.load()
+        except Exception as e:
+            self.error = "Unable to load solaredge_modbus: {}".format(e)
+            return
+
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            delay = self.delay
+
+            if self.connection.allows():
+                try:
+                    self.poll()
+                except ConnectionException:
+                    self.error = "Connection Exception"
+                    self.failed()
+                except Exception as e:
+
+                    # Whatever goes wrong, the thread has to keep on reading; onHeartbeat reports the error.
+
+                    self.error = "Unexpected error: {}".format(e)
+                    self.failed()
+
+            # Wait for the circuit to allow another attempt when the reads keep on failing.
+
+            if self.connection.is_open():
+                delay = self.connection.retryafter - started
+
+            self.stopping.wait(max(0, delay - (time.monotonic() - started)))
+
+#
+# SolarEdge inverters accept only one Modbus TCP client at a time.
+# The RegisterCache keeps the raw registers as read by the InverterReader, together with the time they were read.
+# The ModbusProxy serves those registers to other Modbus TCP clients without bothering the inverter.
+#
+
+class RegisterCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.registers = {}
+
+    def update(self, unit, start, registers):
+        now = time.time()
+        with self.lock:
+            for (offset, value) in enumerate(registers):
+                self.registers[(unit, start + offset)] = (value, now)
+
+    # Returns a list of (value, timestamp) tuples, or None when not all registers are available.
+
+    def get(self, unit, start, length):
+        with self.lock:
+            try:
+                return [self.registers[(unit, address)] for address in range(start, start + length)]
+            except KeyError:
+                return None
+
+#
+# The proxy and the metrics are only served when their options are used.
+# The modules for their servers are imported when the server is created, so they do not slow down loading the plugin.
+# The handlers are mixed in with the request handler class of those modules.
+# A ServerThread runs such a server in a thread of its own.
+#
+
+class ServerThread:
+
+    def __init__(self, name, server):
+        self.name = name
+        self.server = server
+        self.server_address = server.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(name=self.name, target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+#
+# The ModbusProxy only supports "read holding registers" (function code 3).
+# Requests for unit PROXY_AGE_UNIT return the age in seconds of the cached registers of the first inverter instead of their values.
+#
+
+PROXY_AGE_UNIT = 250
+
+class ModbusProxyHandler:
+
+    # Clients may send several requests without waiting; answer each one right away.
+
+    def setup(self):
+        import socket
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def receive(self, length):
+        data = b""
+        while len(data) < length:
+            chunk = self.request.recv(length - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def handle(self):
+        while True:
+            header = self.receive(7)
+            if header is None:
+                return
+
+            (transaction, protocol, length, unit) = struct.unpack(">HHHB", header)
+            pdu = self.receive(length - 1)
+            if not pdu:
+                return
+
+            function = pdu[0]
+
+            if function != 3 or len(pdu) != 5:
+                response = struct.pack(">BB", function | 0x80, 0x01)
+            else:
+                (start, count) = struct.unpack(">HH", pdu[1:5])
+                registers = None
+
+                if 1 <= count <= MAX_REGISTER_BLOCK:
+                    registers = self.server.cache.get(self.server.unit if unit == PROXY_AGE_UNIT else unit, start, count)
+
+                if registers is None:
+                    response = struct.pack(">BB", function | 0x80, 0x02)
+                elif unit == PROXY_AGE_UNIT:
+                    now = time.time()
+                    response = struct.pack(">BB{}H".format(count), function, count * 2, *(min(0xffff, int(now - timestamp)) for (value, timestamp) in registers))
+                else:
+                    response = struct.pack(">BB{}H".format(count), function, count * 2, *(value for (value, timestamp) in registers))
+
+            self.request.sendall(struct.pack(">HHHB", transaction, protocol, len(response) + 1, unit) + response)
+
+class ModbusProxy(ServerThread):
+
+    def __init__(self, host, port, cache, unit):
+        import socketserver
+
+        class Handler(ModbusProxyHandler, socketserver.BaseRequestHandler):
+            pass
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.cache = cache
+        self.unit = unit
+
+        server = Server((host, port), Handler)
+        server.cache = cache
+        server.unit = unit
+        super().__init__("SolarEdgeProxy", server)
+
+#
+# The Metrics keep a few counters and latency histograms, to see whether the inverter and network keep up with the interval.
+# Recording is cheap: a counter is an integer and a histogram is a short list of buckets, so they are always kept.
+# The reader threads and the heartbeat record into the same Metrics; a lock keeps them from getting in each other's way.
+#
+
+METRIC_PREFIX = "solaredge_modbustcp_"
+
+METRIC_COUNTERS = {
+    "modbus_requests_total":        "Modbus requests sent to the inverters.",
+    "modbus_errors_total":          "Reads of the inverters that failed.",
+    "heartbeats_total":             "Heartbeats processed.",
+    "device_updates_total":         "Values stored in Domoticz devices.",
+    "device_updates_skipped_total": "Values not stored because they did not change enough."
+}
+
+METRIC_HISTOGRAMS = {
+    "modbus_request_seconds":   "Round trip time of a Modbus request; requests sent at once count as one.",
+    "decode_seconds":           "Time to decode the registers read from a device.",
+    "heartbeat_seconds":        "Time to process a heartbeat."
+}
+
+METRIC_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+
+    def __init__(self, bounds = METRIC_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(METRIC_COUNTERS, 0)
+        self.histograms = {name: Histogram() for name in METRIC_HISTOGRAMS}
+
+    def increment(self, name, amount = 1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    # The counters, and the sum and count of each histogram, at this moment.
+
+    def totals(self):
+        with self.lock:
+            totals = dict(self.counters)
+            for (name, histogram) in self.histograms.items():
+                totals[name + "_sum"] = histogram.sum
+                totals[name + "_count"] = histogram.count
+        return totals
+
+    # All metrics in the Prometheus text format.
+
+    def render(self):
+        lines = []
+
+        with self.lock:
+            for (name, description) in METRIC_COUNTERS.items():
+                lines.append("# HELP {}{} {}".format(METRIC_PREFIX, name, description))
+                lines.append("# TYPE {}{} counter".format(METRIC_PREFIX, name))
+                lines.append("{}{} {}".format(METRIC_PREFIX, name, self.counters[name]))
+
+            for (name, description) in METRIC_HISTOGRAMS.items():
+                histogram = self.histograms[name]
+                lines.append("# HELP {}{} {}".format(METRIC_PREFIX, name, description))
+                lines.append("# TYPE {}{} histogram".format(METRIC_PREFIX, name))
+
+                count = 0
+                for (bound, bucket) in zip(histogram.bounds + (math.inf,), histogram.buckets):
+                    count += bucket
+                    lines.append("{}{}_bucket{{le=\"{}\"}} {}".format(METRIC_PREFIX, name, "+Inf" if bound == math.inf else bound, count))
+
+                lines.append("{}{}_sum {}".format(METRIC_PREFIX, name, histogram.sum))
+                lines.append("{}{}_count {}".format(METRIC_PREFIX, name, histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+#
+# The MetricsServer serves the Metrics over HTTP, for Prometheus to scrape.
+#
+
+class MetricsHandler:
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Requests are not logged; the handler must never call into Domoticz.
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(ServerThread):
+
+    def __init__(self, host, port, metrics):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(MetricsHandler, BaseHTTPRequestHandler):
+            pass
+
+        self.metrics = metrics
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.metrics = metrics
+        super().__init__("SolarEdgeMetrics", server)
+
+#
+# A capture file holds the raw registers of every successful read, to replay them later on.
+# It starts with CAPTURE_MAGIC, followed by one record per read:
+#
+#   timestamp (double), number of blocks (uint16)
+#   per block: length of the source name (uint8), source name, unit (uint8), start address (uint16),
+#              number of registers (uint16), registers (uint16 each)
+#
+# All numbers are big endian. Records are read one at a time, so a capture of several days is never loaded at once.
+#
+
+CAPTURE_MAGIC = b"SEMBCAP1"
+
+class CaptureWriter:
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, "ab")
+
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+
+    # Called by the readers; there can be more than one writing at the same time.
+
+    def write(self, timestamp, blocks):
+        record = [struct.pack(">dH", timestamp, len(blocks))]
+
+        for (source, unit, start, registers) in blocks:
+            name = source.encode("ascii")
+            record.append(struct.pack(">B{}sBHH{}H".format(len(name), len(registers)), len(name), name, unit, start, len(registers), *registers))
+
+        with self.lock:
+            self.file.write(b"".join(record))
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class CaptureReader:
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+
+        if self.file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            self.file.close()
+            raise ValueError("Not a capture file: {}".format(path))
+
+    def read(self, length):
+        data = self.file.read(length)
+        if len(data) < length:
+            raise EOFError()
+        return data
+
+    # Yields a (timestamp, [(source, unit, start address, registers), ...]) tuple for each record.
+    # A record that was cut off, for example because Domoticz stopped while writing it, ends the capture.
+
+    def __iter__(self):
+        try:
+            while True:
+                (timestamp, count) = struct.unpack(">dH", self.read(10))
+                blocks = []
+
+                for i in range(count):
+                    source = self.read(self.read(1)[0]).decode("ascii")
+                    (unit, start, length) = struct.unpack(">BHH", self.read(5))
+                    blocks.append((source, unit, start, list(struct.unpack(">{}H".format(length), self.read(length * 2)))))
+
+                yield (timestamp, blocks)
+        except EOFError:
+            return
+
+    def close(self):
+        self.file.close()
+
+#
+# The ReplayReader takes the place of the InverterReaders and hands out the captured reads instead.
+# Every take() returns the next record, decoded the same way as a live read; nothing is read from the inverters.
+#
+
+class ReplayReader(InverterReader):
+
+    def __init__(self, path, units, interval, retrydelay):
+        super().__init__(None, None, units, interval, retrydelay, interval, False)
+
+        self.replay = CaptureReader(path)
+        self.records = iter(self.replay)
+        self.finished = False
+
+        # The registers within each captured block, by (source, start address, number of registers).
+
+        self.layouts = {}
+
+        # The names of the registers the plugin needs of each source; a source without all of them is left out.
+
+        self.needed = {}
+
+    def device(self, source):
+        if source != self.source and source not in self.devices:
+            if source.startswith("Meter"):
+                self.devices[source] = solaredge_modbus.Meter(offset=int(source[5:]) - 1, parent=self.inverter)
+            elif source.startswith("Battery"):
+                self.devices[source] = solaredge_modbus.Battery(offset=int(source[7:]) - 1, parent=self.inverter)
+
+        return super().device(source)
+
+    def layout(self, source, start, length):
+        key = (source, start, length)
+
+        if key not in self.layouts:
+            self.layouts[key] = sorted(
+                ((name, register) for (name, register) in self.device(source).registers.items() if start <= register[0] and register[0] + register[1] <= start + length),
+                key=lambda register: register[1][0]
+            )
+
+        return self.layouts[key]
+
+    # The registers are not read, but a captured source has to provide them all.
+
+    def set_registers(self, source, names):
+        registers = self.device(source).registers
+        self.needed[source] = set(name for name in names if name in registers)
+
+    def start(self):
+        self.load()
+
+    def stop(self):
+        self.replay.close()
+
+    def take(self):
+        record = next(self.records, None)
+        if record is None:
+            self.finished = True
+            return (None, None)
+
+        (timestamp, blocks) = record
+        captured = {}
+
+        # Inverters that are not configured can not be processed; their devices would not exist.
+
+        for (source, unit, start, registers) in blocks:
+            if source in UNIT_OFFSETS and (source in self.units or source not in INVERTERS):
+                captured.setdefault(source, []).append((start, registers))
+
+        snapshot = {}
+
+        for (source, blocks) in captured.items():
+            started = time.perf_counter()
+            self.plans[source] = [(start, len(registers), self.layout(source, start, len(registers))) for (start, registers) in blocks]
+
+            values = self.decode(source, [registers for (start, registers) in blocks])
+            self.costs[source] = time.perf_counter() - started
+            if values and self.needed.get(source, set()).issubset(values):
+                snapshot[source] = values
+
+        return (timestamp, snapshot)
+
+#
+# The History keeps the values of the last so many seconds in a memory-mapped file, one slot per second.
+# Domoticz only keeps 5 minute averages; the History keeps each value as read, to study what happens in between.
+#
+# The file has a fixed size: a header with the unit and name of each column, followed by the slots.
+# Each slot has the timestamp and a value for each column, all doubles; NaN when there is no value.
+# A slot belongs to second int(timestamp) % number of slots, so a slot with another second in it is outdated.
+# The numbers are stored in the byte order of the computer that writes them.
+#
+
+HISTORY_MAGIC = b"SEHIST01"
+HISTORY_COLUMNS = 64
+HISTORY_HEADER = struct.Struct("=8sIHH")
+HISTORY_COLUMN = struct.Struct("=H30s")
+HISTORY_DATA = HISTORY_HEADER.size + HISTORY_COLUMNS * HISTORY_COLUMN.size
+HISTORY_SLOT = 1 + HISTORY_COLUMNS
+
+class History:
+
+    #
+    # With a number of seconds, the file is created as needed and written to.
+    # Without it, an existing file is opened to query it.
+    #
+
+    def __init__(self, path, seconds = None):
+        import mmap
+        from array import array
+
+        self.units = {}
+        self.names = []
+        self.empty = array("d", [math.nan] * HISTORY_COLUMNS)
+
+        if seconds:
+            size = HISTORY_DATA + seconds * HISTORY_SLOT * 8
+            with open(path, "a+b") as history:
+                history.seek(0)
+                header = history.read(HISTORY_HEADER.size)
+                if len(header) != HISTORY_HEADER.size or HISTORY_HEADER.unpack(header) != (HISTORY_MAGIC, seconds, HISTORY_COLUMNS, 0):
+
+                    # Start with an empty history; every slot is outdated, as the timestamps are all 0.
+
+                    history.truncate(0)
+                    history.write(HISTORY_HEADER.pack(HISTORY_MAGIC, seconds, HISTORY_COLUMNS, 0))
+                    history.truncate(size)
+
+            self.file = open(path, "r+b")
+            self.mmap = mmap.mmap(self.file.fileno(), size)
+        else:
+            self.file = open(path, "rb")
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            (magic, seconds, columns, reserved) = HISTORY_HEADER.unpack_from(self.mmap)
+            if magic != HISTORY_MAGIC or columns != HISTORY_COLUMNS:
+                self.close()
+                raise ValueError("Not a history file: {}".format(path))
+
+        self.seconds = seconds
+
+        # The slots are accessed as one long array of doubles.
+
+        self.values = memoryview(self.mmap)[HISTORY_DATA:].cast("d")
+
+        for column in range(HISTORY_COLUMNS):
+            (unit, name) = HISTORY_COLUMN.unpack_from(self.mmap, HISTORY_HEADER.size + column * HISTORY_COLUMN.size)
+            if not unit:
+                break
+            self.units[unit] = column
+            self.names.append(name.rstrip(b"\0").decode("utf-8", "replace"))
+
+    def close(self):
+        if getattr(self, "values", None) is not None:
+            self.values.release()
+            self.values = None
+        self.mmap.close()
+        self.file.close()
+
+    #
+    # Returns the column of a unit, adding it to the header when it is new.
+    # Returns None when all columns are in use.
+    #
+
+    def column(self, unit, name):
+        if unit not in self.units:
+            if len(self.units) == HISTORY_COLUMNS:
+                return None
+
+            HISTORY_COLUMN.pack_into(self.mmap, HISTORY_HEADER.size + len(self.units) * HISTORY_COLUMN.size, unit, name.encode("utf-8")[:30])
+            self.units[unit] = len(self.units)
+            self.names.append(name)
+
+        return self.units[unit]
+
+    # Store the values of a number of (column, value) pairs for the second of the timestamp.
+
+    def write(self, timestamp, values):
+        second = int(timestamp)
+        slot = second % self.seconds
+        first = slot * HISTORY_SLOT
+
+        if int(self.values[first]) != second:
+            self.values[first + 1:first + HISTORY_SLOT] = self.empty
+
+        self.values[first] = timestamp
+
+        for (column, value) in values:
+            self.values[first + 1 + column] = value
+
+    #
+    # Yields a (timestamp, [value, ...]) tuple for each second between start and end that has values.
+    # There is a value for each column in use; NaN when there is no value for that second.
+    #
+
+    def range(self, start, end):
+        count = len(self.names)
+
+        for second in range(max(int(start), int(end) - self.seconds + 1), int(end) + 1):
+            first = (second % self.seconds) * HISTORY_SLOT
+            timestamp = self.values[first]
+
+            if int(timestamp) == second:
+                yield (timestamp, self.values[first + 1:first + 1 + count].tolist())
+
+    #
+    # Yields a (timestamp, [average, ...]) tuple for each step of so many seconds between start and end.
+    # The steps start at a multiple of the step size; steps without any values are left out.
+    #
+
+    def downsample(self, start, end, step):
+        count = len(self.names)
+        bucket = None
+
+        for (timestamp, values) in self.range(start, end):
+            index = int(timestamp) // step
+            if index != bucket:
+                if bucket is not None:
+                    yield (bucket * step, [total / number if number else math.nan for (total, number) in zip(totals, numbers)])
+                bucket = index
+                totals = [0.0] * count
+                numbers = [0] * count
+
+            for (column, value) in enumerate(values):
+                if value == value:
+                    totals[column] += value
+                    numbers[column] += 1
+
+        if bucket is not None:
+            yield (bucket * step, [total / number if number else math.nan for (total, number) in zip(totals, numbers)])
+
+    # Write the values between start and end as CSV, optionally averaged over steps of so many seconds.
+
+    def export_csv(self, file, start, end, step = 1):
+
+        # Only the export needs the csv module; there is no need to load it with the plugin.
+
+        import csv
+
+        writer = csv.writer(file)
+        writer.writerow(["time"] + self.names)
+
+        rows = self.range(start, end) if step <= 1 else self.downsample(start, end, step)
+        for (timestamp, values) in rows:
+            writer.writerow(
+                [datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds")] +
+                ["" if value != value else "{:.10g}".format(value) for value in values]
+            )
+
+#
+# The BasePlugin is the actual Domoticz plugin.
+# This is where the fun starts :-)
+#
+
+class BasePlugin:
+
+    def __init__(self):
+
+        # The _LOOKUP_TABLE will point to one of the tables above, depending on the type of inverter.
+
+        self._LOOKUP_TABLE = None
+
+        # Logging is done through the Logger, which knows which log level is active.
+
+        self.log = Logger()
+
+        # The processors compiled from the tables; one list for the inverter and each device connected to it.
+        # The derivations of the values used by the processors of each source.
+        # The table and SunSpec DID of each source, and the sources that confirmed their type since the start.
+
+        self.processors = {}
+        self.derivations = {}
+        self.tables = {}
+        self.dids = {}
+        self.verified = set()
+
+        # The types of the sources and the samples in the math objects are saved in the state file when stopping.
+        # After a restart, the devices can be setup and the averages continue without waiting for the inverter.
+        # The state is restored on the first heartbeat, as setting up the devices may load solaredge_modbus.
+
+        self.state = None
+        self.restored = False
+
+        # The (IP address, unit ID) of each inverter, by source.
+
+        self.inverters = {}
+
+        # Domoticz will generate graphs showing an interval of 5 minutes.
+        # The math objects calculate their values over a period of that many seconds.
+
+        self.period = 300
+
+        # Whether the plugin should add missing devices.
+        # If set to True, a deleted device will be added on the next restart of Domoticz.
+
+        self.add_devices = False
+
+        # When there is an issue contacting the inverter, the plugin will retry after a certain retry delay.
+        # According to the documenation, the inverter may need up to 2 minutes to "reset".
+
+        self.retrydelay = timedelta(minutes = 2)
+
+        # An InverterReader polls the inverters on each host in the background.
+        # The last error and number of failures each of them reported are kept to only log changes.
+
+        self.readers = []
+        self.last_error = {}
+        self.last_failures = {}
+
+        # The values of each source processed in a previous heartbeat.
+
+        self.previous_values = {}
+
+        # The latest scaled values of each inverter, to add up into the site totals.
+
+        self.site_values = {}
+
+        # Optional features are configured in Mode6 as "key=value" pairs separated by semicolons.
+
+        self.options = {}
+
+        # The ModbusProxy serving the cached registers to other clients; None when disabled.
+
+        self.proxy = None
+
+        # The CaptureWriter storing the registers of every read; None when disabled.
+
+        self.capture = None
+
+        # The History keeping the values of every second; None when disabled.
+        # For each source, the processors of the units kept in the history and their columns.
+
+        self.history = None
+        self.history_columns = {}
+
+        # The Metrics of the readers and the heartbeats, and the MetricsServer serving them; None when disabled.
+        # With the diagnostics option, the totals of the previous heartbeat, to calculate the diagnostics since then.
+
+        self.metrics = Metrics()
+        self.metrics_server = None
+        self.diagnostics = None
+        self.heartbeat_time = 0
+        self.last_updated = (0, 0)
+
+        # The new values are staged by unit first and then stored in the devices in one pass.
+        # With a flush interval, the values of several heartbeats are coalesced; only the latest value of each unit is stored.
+
+        self.staged = {}
+        self.flush_interval = 0
+        self.flush_after = 0
+
+    #
+    # onStart is called by Domoticz to start the processing of the plugin.
+    #
+
+    def onStart(self):
+        started = time.perf_counter()
+
+        self.add_devices = bool(Parameters["Mode1"])
+
+        for option in Parameters.get("Mode6", "").split(";"):
+            if "=" in option:
+                (key, value) = option.split("=", 1)
+                self.options[key.strip().lower()] = value.strip()
+
+        # Set the interval at which the information is collected.
+
+        Domoticz.Heartbeat(int(Parameters["Mode2"]))
+
+        self.log.set_level(Parameters.get("Mode5"))
+        self.log.dump_interval = int(self.options.get("dump_interval", 60))
+
+        self.log.debug(
+            "onStart Address: {} Port: {} Device Address: {}",
+            Parameters["Address"],
+            Parameters["Port"],
+            Parameters["Mode3"]
+        )
+
+        # Mode3 holds the Modbus device addresses of one or more inverters, separated by commas.
+        # An inverter with another IP address is written as "unit@address", for example "1,2,3,1@192.168.1.11".
+
+        # Empty entries are skipped; an entry that is not a unit ID is reported and skipped as well.
+
+        hosts = {}
+        for entry in (Parameters["Mode3"] or "1").split(","):
+            (unit, _, host) = entry.strip().partition("@")
+            if not unit.strip() and not host.strip():
+                continue
+
+            try:
+                unit = int(unit)
+            except ValueError:
+                Domoticz.Error("Invalid Device Address: {}; ignoring it".format(entry.strip()))
+                continue
+
+            hosts.setdefault(host.strip() or Parameters["Address"], []).append(unit)
+
+        if not hosts:
+            Domoticz.Error("No valid Device Address in: {}; using 1".format(Parameters["Mode3"]))
+            hosts[Parameters["Address"]] = [1]
+
+        # Lets get in touch with the inverters.
+        # There is a reader for each host; it does that in the background and onHeartbeat will pick up the results.
+        # Only the first inverter can have meters and batteries connected to it.
+
+        sources = iter(INVERTERS)
+
+        for (host, units) in hosts.items():
+            inverters = {}
+
+            for unit in units:
+                source = next(sources, None)
+                if source is None:
+                    Domoticz.Error("Only {} inverters are supported; ignoring Device Address: {} at {}".format(len(INVERTERS), unit, host))
+                    continue
+
+                inverters[source] = unit
+                self.inverters[source] = (host, unit)
+
+            if inverters:
+                self.readers.append(InverterReader(
+                    host,
+                    Parameters["Port"],
+                    inverters,
+                    int(Parameters["Mode2"]),
+                    self.retrydelay,
+                    int(self.options.get("sleep_interval", 120)),
+                    not self.readers and self.options.get("discover", "yes").lower() != "no",
+                    self.options.get("pipeline", "no").lower() == "yes"
+                ))
+
+        # Replay a capture instead of reading the inverters when asked for.
+        # Otherwise, optionally capture every read for a later replay.
+
+        if "replay" in self.options:
+            path = os.path.join(Parameters.get("HomeFolder", ""), self.options["replay"])
+            try:
+                self.readers = [ReplayReader(path, {source: unit for (source, (host, unit)) in self.inverters.items()}, int(Parameters["Mode2"]), self.retrydelay)]
+            except (OSError, ValueError) as e:
+                Domoticz.Error("Unable to replay the capture: {}".format(e))
+                self.readers = []
+            else:
+                Domoticz.Log("Replaying capture: {}".format(path))
+
+        elif "capture" in self.options:
+            path = os.path.join(Parameters.get("HomeFolder", ""), self.options["capture"])
+            try:
+                self.capture = CaptureWriter(path)
+            except OSError as e:
+                Domoticz.Error("Unable to write the capture: {}".format(e))
+            else:
+                for reader in self.readers:
+                    reader.capture = self.capture
+                Domoticz.Log("Capturing the registers to: {}".format(path))
+
+        # Each hardware entry in Domoticz has a state file of its own, unless saving the state is disabled.
+        # A replay must not overwrite the state of the inverters themselves; it only keeps a state in a file named for it.
+
+        state = self.options.get("state", "yes")
+        if state.lower() == "yes":
+            state = "no" if "replay" in self.options else "state_{}.json".format(Parameters.get("HardwareID", 0))
+        if state.lower() != "no":
+            self.state = os.path.join(Parameters.get("HomeFolder", ""), state)
+
+        # Keep the values of every second when asked for.
+
+        if "history" in self.options:
+            path = os.path.join(Parameters.get("HomeFolder", ""), self.options["history"])
+            try:
+                self.history = History(path, int(self.options.get("history_seconds", 86400)))
+            except (OSError, ValueError) as e:
+                Domoticz.Error("Unable to keep the history: {}".format(e))
+            else:
+                Domoticz.Log("Keeping {} seconds of history in: {}".format(self.history.seconds, path))
+
+        # Share the inverters on the first host with other Modbus TCP clients when asked for.
+
+        if "proxy_port" in self.options and self.readers:
+            try:
+                self.proxy = ModbusProxy(self.options.get("proxy_host", "127.0.0.1"), int(self.options["proxy_port"]), RegisterCache(), self.inverters["Inverter"][1])
+            except (OSError, ValueError) as e:
+                Domoticz.Error("Unable to start the Modbus proxy: {}".format(e))
+            else:
+                self.readers[0].cache = self.proxy.cache
+                self.proxy.start()
+                Domoticz.Log("Modbus proxy listening on: {}:{}".format(*self.proxy.server_address))
+
+        # All readers record into the same Metrics, which are served over HTTP when asked for.
+
+        for reader in self.readers:
+            reader.metrics = self.metrics
+
+        if "metrics_port" in self.options:
+            try:
+                self.metrics_server = MetricsServer(self.options.get("metrics_host", "127.0.0.1"), int(self.options["metrics_port"]), self.metrics)
+            except (OSError, ValueError) as e:
+                Domoticz.Error("Unable to start the metrics server: {}".format(e))
+            else:
+                self.metrics_server.start()
+                Domoticz.Log("Metrics available on: http://{}:{}/metrics".format(*self.metrics_server.server_address))
+
+        if self.options.get("diagnostics", "no").lower() == "yes":
+            self.diagnostics = self.metrics.totals()
+
+        self.flush_interval = float(self.options.get("flush_interval", 0))
+
+        # The inverters are contacted by the readers in the background; Domoticz does not have to wait for that.
+
+        for reader in self.readers:
+            reader.start()
+
+        Domoticz.Log("Started in {:.0f} ms; loading the plugin took {:.0f} ms".format((time.perf_counter() - started) * 1000, (LOADED - LOADING) * 1000))
+
+    #
+    # onStop is called by Domoticz when the plugin is stopped.
+    # The reader thread has to be stopped before Domoticz unloads the plugin.
+    #
+
+    def onStop(self):
+        if self.staged:
+            self.flushDevices()
+
+        if self.state and self.restored:
+            self.saveState()
+
+        if self.proxy:
+            self.proxy.stop()
+            self.proxy = None
+
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+        for reader in self.readers:
+            reader.stop()
+        self.readers = []
+
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+
+        if self.history:
+            self.history.close()
+            self.history = None
+
+
+    #
+    # OnHeartbeat is called by Domoticz at a specific interval as set in onStart()
+    #
+
+    def onHeartbeat(self):
+        self.log.debug("onHeartbeat")
+        started = time.perf_counter()
+
+        # Pick up where the plugin left off.
+
+        if self.state and not self.restored:
+            self.loadState()
+            self.restored = True
+
+        # Pick up the latest values read by each reader; a reader that read nothing new since the last heartbeat adds nothing.
+
+        snapshot = {}
+        timestamps = {}
+
+        for reader in self.readers:
+            (timestamp, values) = reader.take()
+            if values:
+                snapshot.update(values)
+                timestamps.update(dict.fromkeys(values, timestamp))
+
+            self.checkConnection(reader)
+
+        # While an inverter is sleeping, its values hardly change.
+        # The math objects hold on to the previous values anyway, so skip the values when nothing changed.
+
+        for source in [source for source in snapshot if source in INVERTERS]:
+            if snapshot[source].get("status") in SLEEPING_STATUS and snapshot[source] == self.previous_values.get(source):
+                self.log.debug("{} is sleeping; nothing changed", source)
+                del snapshot[source]
+            else:
+                self.previous_values[source] = snapshot[source]
+
+        self.addSiteTotals(snapshot, timestamps)
+        self.addDiagnostics(snapshot, timestamps)
+
+        # We need to make sure that we have a table to work with for each source.
+        # These will be set by contactInverter once it is clear that
+        # the source responds and that a matching table is available.
+
+        if not self.verified or any(source not in self.verified for source in snapshot):
+            self.contactInverter(snapshot)
+
+        self.addDerivedValues(snapshot)
+
+        if self.processors and snapshot:
+
+            self.log.dump(snapshot)
+
+            # Now process each unit in the tables of the inverters and the devices connected to them.
+            # The new values are staged; the devices are updated in one go afterwards.
+
+            staged = self.staged
+
+            for (source, processors) in self.processors.items():
+                values = snapshot.get(source)
+                if values is None:
+                    continue
+
+                timestamp = timestamps[source]
+
+                for processor in processors:
+
+                    # Skip a unit when the matching device got deleted, unless another unit prepends its value.
+
+                    if processor.id not in Devices and not processor.required:
+                        continue
+
+                    value = processor.transform(values, timestamp)
+                    self.log.debug("{} = {}", processor.name, value)
+
+                    staged[processor.id] = (processor, value, timestamp)
+
+            # Keep the values as read in the history, before any math is applied.
+
+            if self.history:
+                for (source, columns) in self.history_columns.items():
+                    values = snapshot.get(source)
+                    if values is not None:
+                        timestamp = timestamps[source]
+                        self.history.write(timestamp, [(column, processor.scaled_value(values, timestamp)) for (processor, column) in columns])
+
+            if time.monotonic() >= self.flush_after:
+                self.flushDevices()
+
+        elif self._LOOKUP_TABLE:
+            self.log.debug("No new values from the inverter")
+
+        self.heartbeat_time = time.perf_counter() - started
+        self.metrics.observe("heartbeat_seconds", self.heartbeat_time)
+        self.metrics.increment("heartbeats_total")
+
+    #
+    # Store the staged values in the devices, in the order of their units.
+    # Only store a value in Domoticz when it has changed enough.
+    #
+    # The values are formatted here, only once per flush.
+    # The units that prepend another value come last, so they get the value that was just stored.
+    # A power that changed too little to be stored does not cause an update of the energy either.
+    #
+
+    def flushDevices(self):
+        updated = 0
+        skipped = 0
+
+        for (unit, (processor, value, timestamp)) in sorted(self.staged.items(), key=lambda item: (item[1][0].prepend is not None, item[0])):
+
+            # Without a device, a prepended value is still filtered like it would have been stored.
+
+            device = Devices.get(unit)
+            if device is None:
+                if processor.needs_update(value, timestamp):
+                    processor.stored(value, timestamp)
+                continue
+
+            sValue = processor.render(value)
+            if sValue != device.sValue and processor.needs_update(value, timestamp):
+                device.Update(nValue=0, sValue=sValue, TimedOut=0)
+                processor.stored(value, timestamp)
+                updated += 1
+            else:
+
+                # The device may already show the first value, for example after a restart.
+
+                if processor.stored_at is None:
+                    processor.stored(value, timestamp)
+                skipped += 1
+
+        Domoticz.Log("Updated {} values out of {}; read {}".format(
+            updated,
+            len(self.staged),
+            ", ".join("{}: {:.0f} ms".format(source, cost * 1000) for reader in self.readers for (source, cost) in list(reader.costs.items()))
+        ))
+
+        self.metrics.increment("device_updates_total", updated)
+        self.metrics.increment("device_updates_skipped_total", skipped)
+        self.last_updated = (updated, skipped)
+
+        self.staged.clear()
+        self.flush_after = time.monotonic() + self.flush_interval
+
+    #
+    # Log the problems a reader runs into; only log changes to keep the log readable.
+    #
+
+    def checkConnection(self, reader):
+        connection = reader.connection
+
+        if reader.error != self.last_error.get(reader.source):
+            self.last_error[reader.source] = reader.error
+            if reader.error:
+                Domoticz.Log("{} when trying to contact: {}:{} Device Address: {}".format(
+                    reader.error,
+                    reader.host,
+                    reader.port,
+                    ",".join(str(unit) for unit in reader.units.values())
+                ))
+            elif connection.failures:
+                Domoticz.Log("Connection restored; failures: {} reconnects: {}".format(connection.failures, connection.reconnects))
+
+        if connection.is_open() and connection.failures != self.last_failures.get(reader.source):
+            self.last_failures[reader.source] = connection.failures
+            last_good_read = connection.since_last_good_read()
+            Domoticz.Log("Retrying to communicate with {} in {:.0f} seconds; failures: {} reconnects: {} last good read: {}".format(
+                reader.host,
+                max(0, connection.retryafter - time.monotonic()),
+                connection.failures,
+                connection.reconnects,
+                "{:.0f} seconds ago".format(last_good_read) if last_good_read is not None else "never"
+            ))
+
+    #
+    # With more than one inverter, add up their values into the site totals.
+    # The latest values of each inverter are kept, so the totals are also available when only some inverters were read.
+    # Till every inverter was read at least once, there are no totals.
+    #
+
+    def addSiteTotals(self, snapshot, timestamps):
+        if len(self.inverters) < 2:
+            return
+
+        read = [source for source in INVERTERS if source in snapshot]
+        if not read:
+            return
+
+        for source in read:
+            values = snapshot[source]
+            self.site_values[source] = {name: scaled(values[name], values[scale]) for (name, scale) in SITE_REGISTERS.items()}
+
+        if len(self.site_values) == len(self.inverters):
+            snapshot["Site"] = {name: sum(values[name] for values in self.site_values.values()) for name in SITE_REGISTERS}
+            timestamps["Site"] = max(timestamps[source] for source in read)
+
+    #
+    # Add the derived values to the values of each source that uses them.
+    # The values of the readers are kept as read; the sleeping inverters are compared with those.
+    #
+
+    def addDerivedValues(self, snapshot):
+        for (source, derivations) in self.derivations.items():
+            values = snapshot.get(source)
+            if values is None or not derivations:
+                continue
+
+            values = snapshot[source] = dict(values)
+            for (function, names, registers) in derivations:
+                if all(register in values for register in registers):
+                    values.update(zip(names, function(values)))
+
+    #
+    # With the diagnostics option, add the diagnostics since the previous heartbeat with new values.
+    # The time and updates of a heartbeat are only known at its end, so those are of the previous heartbeat.
+    # The read load is the share of the time spent waiting for Modbus requests.
+    #
+
+    def addDiagnostics(self, snapshot, timestamps):
+        if self.diagnostics is None or not snapshot:
+            return
+
+        totals = self.metrics.totals()
+        now = time.time()
+        delta = {name: totals[name] - self.diagnostics[name] for name in totals}
+        elapsed = now - self.diagnostics.get("timestamp", now)
+
+        snapshot["Diagnostics"] = {
+            "request_time":      delta["modbus_request_seconds_sum"] / delta["modbus_request_seconds_count"] * 1000 if delta["modbus_request_seconds_count"] else 0,
+            "decode_time":       delta["decode_seconds_sum"] / delta["decode_seconds_count"] * 1000 if delta["decode_seconds_count"] else 0,
+            "heartbeat_time":    self.heartbeat_time * 1000,
+            "device_updates":    self.last_updated[0],
+            "skipped_updates":   self.last_updated[1],
+            "connection_errors": totals["modbus_errors_total"],
+            "read_load":         min(100, delta["modbus_request_seconds_sum"] / elapsed * 100) if elapsed > 0 else 0
+        }
+        timestamps["Diagnostics"] = now
+
+        self.diagnostics = totals
+        self.diagnostics["timestamp"] = now
+
+    #
+    # Setup the sources from the state file, with the samples of their math objects.
+    # Their types are confirmed as soon as the inverters respond.
+    #
+
+    def loadState(self):
+        try:
+            with open(self.state) as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            Domoticz.Error("Unable to load the state: {}".format(e))
+            return
+
+        for (source, saved) in state.get("sources", {}).items():
+
+            # Inverters that are no longer configured are left out, and so are the site totals of a single inverter
+            # and the diagnostics when they are disabled.
+
+            if source not in UNIT_OFFSETS or (source in INVERTERS and source not in self.inverters) or (source == "Site" and len(self.inverters) < 2):
+                continue
+            if source == "Diagnostics" and self.diagnostics is None:
+                continue
+
+            table = self.findTable(source, saved.get("did"))
+            if table is None:
+                continue
+
+            self.setupDevices(source, table)
+            self.dids[source] = saved.get("did")
+
+            windows = saved.get("windows", {})
+            for processor in self.processors[source]:
+                if processor.math and str(processor.id) in windows:
+                    processor.math.set_samples(windows[str(processor.id)])
+
+        Domoticz.Log("Restored the state of: {}".format(", ".join(self.tables) or "nothing"))
+
+    def saveState(self):
+        state = {
+            "saved": time.time(),
+            "sources": {
+                source: {
+                    "did": self.dids.get(source),
+                    "windows": {str(processor.id): samples for (processor, samples) in
+                                ((processor, processor.math.get_samples()) for processor in self.processors[source] if processor.math) if samples}
+                }
+                for source in self.tables
+            }
+        }
+
+        # Write a new file first, so a crash while writing does not leave a broken state behind.
+
+        try:
+            with open(self.state + ".new", "w") as state_file:
+                json.dump(state, state_file)
+            os.replace(self.state + ".new", self.state)
+        except OSError as e:
+            Domoticz.Error("Unable to save the state: {}".format(e))
+
+    #
+    # Contact the inverters and find out what type they are.
+    # Setup the devices of each source in the snapshot that was not confirmed yet.
+    # A source that was setup from the saved state keeps its devices when its type did not change.
+    #
+    
+    def contactInverter(self, snapshot):
+
+        # The readers keep on trying in the background.
+        # There are multiple reasons why this may fail.
+        # - Perhaps the ip address or port are incorrect.
+        # - The inverter may not be connected to the networ,
+        # - The inverter may be turned off.
+        # - The inverter has a bad hairday....
+        # Try again when it comes up with some information.
+
+        if snapshot:
+            for (source, values) in snapshot.items():
+                if source in self.verified:
+                    continue
+
+                did = values.get("c_sunspec_did")
+
+                if source in INVERTERS:
+                    (host, unit) = self.inverters[source]
+                    Domoticz.Log("Connection established with: {}:{} Device Address: {}".format(host, Parameters["Port"], unit))
+                    Domoticz.Log("{} type: {}".format(source, solaredge_modbus.sunspecDID(did)))
+                elif source.startswith(("Meter", "Battery")):
+                    Domoticz.Log("Found {}: {} {}".format(source, values.get("c_manufacturer"), values.get("c_model")))
+
+                table = self.findTable(source, did)
+                if table is None:
+                    Domoticz.Log("Unsupported inverter type: {}".format(solaredge_modbus.sunspecDID(did)))
+                    continue
+
+                if self.tables.get(source) is not table:
+                    self.setupDevices(source, table)
+
+                # The status is always needed to find out whether the inverter is sleeping.
+                # With more than one inverter, the values for the site totals are needed as well.
+
+                names = []
+                if source in INVERTERS:
+                    names.append("status")
+                    if len(self.inverters) > 1:
+                        names.extend(SITE_REGISTERS.keys())
+                        names.extend(SITE_REGISTERS.values())
+
+                self.setupRegisters(source, table, names)
+
+                self.dids[source] = did
+                self.verified.add(source)
+        else:
+            self.log.debug("Waiting for the inverter to respond")
+
+    #
+    # Find the table for a source; inverters have a table for each supported type.
+    # The meters and batteries that were found all have the same type of table.
+    # Each table is built once, so a source that was setup already gets the same table again.
+    #
+
+    def findTable(self, source, did):
+        if source in INVERTERS:
+            table = INVERTER_TABLES.get(did)
+            return table() if table else None
+        elif source.startswith("Meter"):
+            return meter_table()
+        elif source.startswith("Battery"):
+            return battery_table()
+        elif source == "Site":
+            return site_table()
+        elif source == "Diagnostics":
+            return diagnostics_table()
+        else:
+            return None
+
+    #
+    # Setup the devices in Domoticz for one of the tables and compile the processors for it.
+    # Each source has its own range of units; the names of the devices of meters and batteries start with the source.
+    #
+
+    def setupDevices(self, source, table):
+        offset = UNIT_OFFSETS[source]
+        prefix = "" if source == "Inverter" else source + " "
+
+        self.tables[source] = table
+        if source == "Inverter":
+            self._LOOKUP_TABLE = table
+
+        # Compile the table into processors, so the heartbeat has as little work to do as possible.
+
+        math_enabled = Parameters["Mode4"] == "math_enabled"
+        max_age = int(self.options.get("max_update_age", self.period))
+        self.processors[source] = [Processor(unit, offset, prefix, math_enabled, self.period, max_age) for unit in table]
+
+        # The energy rows of a source share one integrator; the views show another part of it.
+
+        energy = next((processor.math for processor in self.processors[source] if isinstance(processor.math, Energy)), None)
+        for processor in self.processors[source]:
+            if isinstance(processor.math, EnergyView):
+                processor.math.energy = energy
+
+        # A unit that prepends another gets the value stored by the processor of that unit.
+
+        processors = {processor.id: processor for processor in self.processors[source]}
+        for processor in self.processors[source]:
+            if processor.prepend:
+                processor.prepended = processors[processor.prepend]
+                processor.prepended.required = True
+
+        # We updated some device types over time.
+        # Let's make sure that we have the correct type setup.
+
+        for unit in table:
+            if offset + unit[Column.ID] in Devices:
+                device = Devices[offset + unit[Column.ID]]
+
+                if (device.Type != unit[Column.TYPE] or
+                    device.SubType != unit[Column.SUBTYPE] or
+                    device.SwitchType != unit[Column.SWITCHTYPE] or
+                    device.Options != unit[Column.OPTIONS]):
+
+                    Domoticz.Log("Updating device \"{}\"".format(device.Name))
+
+                    nValue = device.nValue
+                    sValue = device.sValue
+
+                    device.Update(
+                            Type=unit[Column.TYPE],
+                            Subtype=unit[Column.SUBTYPE],
+                            Switchtype=unit[Column.SWITCHTYPE],
+                            Options=unit[Column.OPTIONS],
+                            nValue=nValue,
+                            sValue=sValue
+                    )
+
+        # Add missing devices if needed.
+
+        if self.add_devices:
+            for unit in table:
+                if offset + unit[Column.ID] not in Devices:
+                    Domoticz.Device(
+                        Unit=offset + unit[Column.ID],
+                        Name=prefix + unit[Column.NAME],
+                        Type=unit[Column.TYPE],
+                        Subtype=unit[Column.SUBTYPE],
+                        Switchtype=unit[Column.SWITCHTYPE],
+                        Options=unit[Column.OPTIONS],
+                        Used=1,
+                    ).Create()
+
+        # Only derive the values that are used by a device that exists.
+
+        used = set(processor.modbusname for processor in self.processors[source] if processor.id in Devices or processor.required)
+        self.derivations[source] = [derivation for derivation in DERIVED_VALUES if used.intersection(derivation[1])]
+
+        # Only numbers can be kept in the history; values looked up in a table are left out.
+        # A register is kept once, even when more devices are calculated from it.
+
+        if self.history:
+            columns = []
+            for processor in self.processors[source]:
+                if processor.lookup or processor.id not in Devices or any(processor.modbusname == kept.modbusname for (kept, column) in columns):
+                    continue
+
+                column = self.history.column(processor.id, processor.name)
+                if column is None:
+                    Domoticz.Log("No room left in the history for: {}".format(processor.name))
+                else:
+                    columns.append((processor, column))
+
+            self.history_columns[source] = columns
+
+    #
+    # Only read the registers that are used by the devices that exist, together with the given names.
+    # The site totals are not read from a device, so there is nothing to read for them.
+    #
+
+    def setupRegisters(self, source, table, names):
+        offset = UNIT_OFFSETS[source]
+
+        reader = next((reader for reader in self.readers if source in reader.plans), None)
+        if reader is None:
+            return
+
+        # The units that are prepended to another one are read, even when their device got deleted.
+
+        required = set(processor.id for processor in self.processors[source] if processor.required)
+
+        for unit in table:
+            if offset + unit[Column.ID] in Devices or offset + unit[Column.ID] in required:
+                names.append(unit[Column.MODBUSNAME])
+                if unit[Column.MODBUSSCALE]:
+                    names.append(unit[Column.MODBUSSCALE])
+
+                # The energy is integrated from the power, even when the power device got deleted.
+                # A view integrates with the Energy of the same table.
+
+                energy = unit[Column.MATH]
+                if isinstance(energy, EnergyView):
+                    energy = next(row[Column.MATH] for row in table if isinstance(row[Column.MATH], Energy))
+
+                if isinstance(energy, Energy):
+                    names.append(energy.power)
+                    if energy.power_scale:
+                        names.append(energy.power_scale)
+
+        for (function, derived, registers) in self.derivations.get(source, []):
+            names.extend(registers)
+
+        # The proxy serves all registers of the first host to its clients, so it keeps on reading all of them.
+
+        if names and not (self.proxy and reader is self.readers[0]):
+            reader.set_registers(source, names)
+
+        Domoticz.Log("Reading {} registers: {}".format(source, ", ".join(
+            "{:#x}-{:#x}".format(start, start + length - 1) for (start, length, registers) in reader.plans[source]
+        )))
+
+
+#
+# Instantiate the plugin and register the supported callbacks.
+# Currently that is only onStart(), onStop() and onHeartbeat()
+#
+
+global _plugin
+_plugin = BasePlugin()
+
+LOADED = time.perf_counter()
+
+def onStart():
+    global _plugin
+    _plugin.onStart()
+
+def onStop():
+    global _plugin
+    _plugin.onStop()
 
 def onHeartbeat():
     global _plugin
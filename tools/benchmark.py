@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# SolarEdge ModbusTCP - offline benchmark
+#
+# Source:  https://github.com/addiejanssen/domoticz-solaredge-modbustcp-plugin
+# Author:  Addie Janssen (https://addiejanssen.com)
+# License: MIT
+#
+
+"""
+Runs the plugin outside of Domoticz against simulated inverters and reports how it performs.
+
+    python3 tools/benchmark.py --heartbeats 2000 --phases 3 --inverters 2
+
+The simulated inverters are served by a pymodbus server on localhost, so the plugin reads them
+over the same kind of connection as a real inverter, from a Modbus implementation other than its own.
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+import types
+
+#
+# The plugin imports the Domoticz module, which only exists inside Domoticz.
+# This stand-in offers just enough of it for the plugin: logging, the heartbeat and devices.
+# It is injected into sys.modules, so it never shadows the real module in the plugin folder.
+#
+
+class Device:
+
+    updates = 0
+
+    def __init__(self, Unit, Name, Type, Subtype, Switchtype = 0, Options = None, Used = 0):
+        self.Unit = Unit
+        self.Name = Name
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Options = Options or {}
+        self.Used = Used
+        self.nValue = 0
+        self.sValue = ""
+
+    def Create(self):
+        Domoticz.Devices[self.Unit] = self
+
+    def Update(self, nValue = 0, sValue = "", TimedOut = 0, Type = None, Subtype = None, Switchtype = None, Options = None):
+        Device.updates += 1
+        self.nValue = nValue
+        self.sValue = sValue
+        if Type is not None:
+            self.Type = Type
+            self.SubType = Subtype
+            self.SwitchType = Switchtype
+            self.Options = Options
+
+def log(message):
+    Domoticz.messages += 1
+    if Domoticz.verbose:
+        print(message)
+
+Domoticz = types.ModuleType("Domoticz")
+Domoticz.Devices = {}
+Domoticz.messages = 0
+Domoticz.verbose = False
+Domoticz.Device = Device
+Domoticz.Log = log
+Domoticz.Error = log
+Domoticz.Debug = log
+Domoticz.Debugging = lambda level: None
+Domoticz.Heartbeat = lambda interval: None
+
+sys.modules["Domoticz"] = Domoticz
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solaredge_modbus
+import plugin
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+from pymodbus.server.sync import ModbusTcpServer
+
+#
+# A SunSpec inverter with values that change a little on every step.
+# Its registers are stored in the holding registers of its unit in the pymodbus server, which serves them like an inverter would.
+#
+
+INVERTER_VALUES = {
+    "c_manufacturer": "SolarEdge", "c_model": "SE5K", "c_version": "0004.0011.0030", "c_serialnumber": "7E0000FF",
+    "c_deviceaddress": 1, "c_sunspec_did": 101,
+    "current": 1234, "l1_current": 1234, "l2_current": 0, "l3_current": 0, "current_scale": -2,
+    "l1_voltage": 4000, "l2_voltage": 4000, "l3_voltage": 4000, "l1n_voltage": 2300, "l2n_voltage": 2300, "l3n_voltage": 2300, "voltage_scale": -1,
+    "power_ac": 2800, "power_ac_scale": 0, "frequency": 5000, "frequency_scale": -2,
+    "power_apparent": 2850, "power_apparent_scale": 0, "power_reactive": 100, "power_reactive_scale": 0, "power_factor": 98, "power_factor_scale": 0,
+    "energy_total": 1234567, "energy_total_scale": 0,
+    "current_dc": 700, "current_dc_scale": -2, "voltage_dc": 4000, "voltage_dc_scale": -1, "power_dc": 2900, "power_dc_scale": 0,
+    "temperature": 4500, "temperature_scale": -2, "status": 4, "vendor_status": 0,
+    "rrcr_state": 0, "active_power_limit": 100, "cosphi": 1.0
+}
+
+class SimulatedInverter:
+
+    def __init__(self, context, unit, phases, seed):
+        self.context = context
+        self.unit = unit
+        self.random = random.Random(seed)
+        self.device = solaredge_modbus.Inverter(host="127.0.0.1", port=0, unit=unit)
+        self.values = dict(INVERTER_VALUES, c_deviceaddress=unit, c_sunspec_did=101 if phases == 1 else 103)
+        self.step(0)
+
+    def step(self, timestamp):
+        values = self.values
+        noise = self.random.uniform
+
+        values["power_ac"] = max(0, int(2800 + 2000 * math.sin(timestamp / 600) + noise(-50, 50)))
+        values["power_dc"] = values["power_ac"] + 100
+        values["current"] = values["l1_current"] = int(values["power_ac"] / 2.3)
+        values["l1n_voltage"] = int(2300 + noise(-20, 20))
+        values["frequency"] = int(5000 + noise(-5, 5))
+        values["temperature"] = int(4500 + noise(-30, 30))
+        values["energy_total"] += values["power_ac"] // 720
+
+        # The whole model is stored, including the unused registers in between, just like an inverter would answer.
+
+        registers = [0] * 120
+        for (name, register) in self.device.registers.items():
+            (address, length, kind, dtype) = register[:4]
+            if address >= 40120:
+                continue
+
+            value = values[name]
+            if dtype == solaredge_modbus.registerDataType.STRING:
+                value = value.ljust(length * 2, "\0")
+            elif dtype == solaredge_modbus.registerDataType.ACC32:
+                dtype = solaredge_modbus.registerDataType.UINT32
+
+            registers[address - 40000:address - 40000 + length] = self.device._encode_value(value, dtype)[:length]
+
+        self.context.setValues(3, 40000, registers)
+
+#
+# The registers of a unit in the pymodbus server; it also counts the Modbus requests it answered.
+# Only the SunSpec inverter model is there, so reading the meters and batteries returns an "illegal address" exception.
+#
+
+class SimulatedContext(ModbusSlaveContext):
+
+    requests = 0
+
+    def __init__(self):
+        super().__init__(hr=ModbusSequentialDataBlock(40000, [0] * 120), zero_mode=True)
+
+    def validate(self, fx, address, count = 1):
+        SimulatedContext.requests += 1
+        return super().validate(fx, address, count)
+
+class SimulatedServer(ModbusTcpServer):
+
+    def __init__(self, units):
+        self.units = {unit: SimulatedContext() for unit in units}
+        super().__init__(ModbusServerContext(slaves=self.units, single=False), address=("127.0.0.1", 0))
+        self.thread = threading.Thread(name="SimulatedInverters", target=self.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the plugin against simulated inverters.")
+    parser.add_argument("--heartbeats", type=int, default=1000, help="number of heartbeats to run (default: 1000)")
+    parser.add_argument("--phases", type=int, choices=(1, 3), default=1, help="single or three phase inverters (default: 1)")
+    parser.add_argument("--inverters", type=int, choices=(1, 2, 3, 4), default=1, help="number of inverters (default: 1)")
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between reads of the inverters (default: 0.005)")
+    parser.add_argument("--no-math", action="store_true", help="disable the Auto Avg/Max math")
+    parser.add_argument("--options", default="", help="the Options field of the plugin, e.g. \"pipeline=yes\"")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the simulated values (default: 1)")
+    parser.add_argument("--max-p99", type=float, help="fail when the 99th percentile of the heartbeat latency exceeds this many microseconds")
+    parser.add_argument("--verbose", action="store_true", help="print the log of the plugin")
+    args = parser.parse_args()
+
+    Domoticz.verbose = args.verbose
+
+    units = range(1, args.inverters + 1)
+    server = SimulatedServer(units)
+    server.start()
+
+    inverters = [SimulatedInverter(server.units[unit], unit, args.phases, args.seed + unit) for unit in units]
+
+    plugin.Devices = Domoticz.Devices
+    plugin.Parameters = {
+        "Address": "127.0.0.1",
+        "Port": str(server.server_address[1]),
+        "Mode1": "Yes",
+        "Mode2": "1",
+        "Mode3": ",".join(str(inverter.unit) for inverter in inverters),
+        "Mode4": "math_disabled" if args.no_math else "math_enabled",
+        "Mode5": "Normal",
+        "Mode6": "state=no;" + args.options
+    }
+
+    started = time.perf_counter()
+    plugin.onStart()
+    startup = time.perf_counter() - started
+
+    # Domoticz only supports whole seconds; read much faster than that to run a lot of heartbeats in little time.
+
+    for reader in plugin._plugin.readers:
+        reader.interval = reader.delay = reader.sleep_interval = reader.connection.interval = args.interval
+
+    latencies = []
+    timeouts = 0
+    requests = SimulatedContext.requests
+    started = time.perf_counter()
+
+    for heartbeat in range(args.heartbeats):
+
+        # Wait for new values of all inverters, so each heartbeat has something to process.
+
+        deadline = time.monotonic() + 5
+        while any(reader.snapshot is None for reader in plugin._plugin.readers) and time.monotonic() < deadline:
+            time.sleep(args.interval / 10)
+        if time.monotonic() >= deadline:
+            timeouts += 1
+
+        before = time.perf_counter()
+        plugin.onHeartbeat()
+        latencies.append(time.perf_counter() - before)
+
+        for inverter in inverters:
+            inverter.step(heartbeat)
+
+    elapsed = time.perf_counter() - started
+    requests = SimulatedContext.requests - requests
+
+    plugin.onStop()
+    server.stop()
+
+    latencies.sort()
+    p99 = percentile(latencies, 0.99) * 1e6
+
+    print("{} heartbeats in {:.1f} seconds; {} inverter(s), {} phase(s), math {}".format(
+        args.heartbeats, elapsed, args.inverters, args.phases, "disabled" if args.no_math else "enabled"))
+    print("heartbeat latency: mean {:.0f} us, p50 {:.0f} us, p90 {:.0f} us, p99 {:.0f} us, max {:.0f} us".format(
+        sum(latencies) / len(latencies) * 1e6,
+        percentile(latencies, 0.50) * 1e6,
+        percentile(latencies, 0.90) * 1e6,
+        p99,
+        latencies[-1] * 1e6
+    ))
+    print("startup: loading the plugin {:.1f} ms, onStart {:.1f} ms".format((plugin.LOADED - plugin.LOADING) * 1000, startup * 1000))
+    print("reads: {} Modbus requests, {:.0f} per second".format(requests, requests / elapsed))
+    print("devices: {}, Device.Update calls: {}, log messages: {}, heartbeats without new values: {}".format(
+        len(Domoticz.Devices), Device.updates, Domoticz.messages, timeouts))
+
+    if args.max_p99 is not None and p99 > args.max_p99:
+        print("FAILED: p99 heartbeat latency {:.0f} us exceeds {:.0f} us".format(p99, args.max_p99))
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
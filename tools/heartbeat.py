@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# SolarEdge ModbusTCP - heartbeat processing benchmark
+#
+# Source:  https://github.com/addiejanssen/domoticz-solaredge-modbustcp-plugin
+# Author:  Addie Janssen (https://addiejanssen.com)
+# License: MIT
+#
+
+"""
+Compares the time to process the values of a heartbeat with the compiled processors and
+with the table interpretation the plugin used before.
+
+    python3 tools/heartbeat.py --phases 3 --heartbeats 20000
+
+No inverter is read; the same values are processed over and over again, with a new timestamp each time.
+"""
+
+import argparse
+import sys
+import time
+
+import benchmark
+import plugin
+
+from benchmark import Domoticz, percentile
+
+Column = plugin.Column
+
+#
+# The heartbeat as it used to be: every row of the table is interpreted again for every heartbeat.
+# Only the Average, Maximum and Minimum windows were math objects then; the other rows are scaled.
+#
+
+def interpret(table, values, timestamp, templates):
+    Parameters = plugin.Parameters
+    Devices = plugin.Devices
+
+    for unit in table:
+        Domoticz.Debug(str(unit))
+
+        if unit[Column.ID] in Devices:
+            Domoticz.Debug("-> found in Devices")
+
+            if unit[Column.LOOKUP]:
+                Domoticz.Debug("-> looking up...")
+
+                lookup_table = unit[Column.LOOKUP]
+                to_lookup = int(values[unit[Column.MODBUSNAME]])
+
+                if to_lookup >= 0 and to_lookup < len(lookup_table):
+                    value = lookup_table[to_lookup]
+                else:
+                    value = "Key not found in lookup table: {}".format(to_lookup)
+
+            elif unit[Column.ID] in templates and Parameters["Mode4"] == "math_enabled":
+                Domoticz.Debug("-> calculating...")
+                m = templates[unit[Column.ID]]
+                if unit[Column.MODBUSSCALE]:
+                    m.add(values[unit[Column.MODBUSNAME]] * (10 ** values[unit[Column.MODBUSSCALE]]), timestamp)
+                else:
+                    m.add(values[unit[Column.MODBUSNAME]], timestamp)
+
+                value = m.get()
+
+            elif unit[Column.MODBUSSCALE]:
+                Domoticz.Debug("-> scaling...")
+                value = values[unit[Column.MODBUSNAME]] * (10 ** values[unit[Column.MODBUSSCALE]])
+
+            else:
+                Domoticz.Debug("-> copying...")
+                value = values[unit[Column.MODBUSNAME]]
+
+            Domoticz.Debug("value = {}".format(value))
+
+            if unit[Column.PREPEND]:
+                Domoticz.Debug("-> has prepend")
+                prepend = Devices[unit[Column.PREPEND]].sValue
+                Domoticz.Debug("prepend = {}".format(prepend))
+                sValue = unit[Column.FORMAT].format(prepend, value)
+            else:
+                Domoticz.Debug("-> no prepend")
+                sValue = unit[Column.FORMAT].format(value)
+
+            Domoticz.Debug("sValue = {}".format(sValue))
+
+#
+# The heartbeat as it is now: the compiled processors of the source transform the values and render them when updating the devices.
+#
+
+def process(processors, values, timestamp, staged):
+    Devices = plugin.Devices
+
+    for processor in processors:
+        if processor.id not in Devices:
+            continue
+
+        value = processor.transform(values, timestamp)
+        plugin._plugin.log.debug("{} = {}", processor.name, value)
+
+        staged[processor.id] = (processor, value, timestamp)
+
+    # The values are formatted when the devices are updated, once per heartbeat without coalescing.
+    # The units that prepend another value come last, like they do in the plugin.
+
+    for (unit, (processor, value, timestamp)) in sorted(staged.items(), key=lambda item: (item[1][0].prepend is not None, item[0])):
+        processor.render(value)
+        processor.stored(value, timestamp)
+
+def measure(function, heartbeats):
+    latencies = []
+    for heartbeat in range(heartbeats):
+        started = time.perf_counter()
+        function(heartbeat)
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    return latencies
+
+def report(name, latencies):
+    print("{:>12}: mean {:.0f} us, p50 {:.0f} us, p90 {:.0f} us, p99 {:.0f} us".format(
+        name,
+        sum(latencies) / len(latencies) * 1e6,
+        percentile(latencies, 0.50) * 1e6,
+        percentile(latencies, 0.90) * 1e6,
+        percentile(latencies, 0.99) * 1e6
+    ))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the heartbeat processing before and after compiling the tables.")
+    parser.add_argument("--heartbeats", type=int, default=20000, help="number of heartbeats to process (default: 20000)")
+    parser.add_argument("--phases", type=int, choices=(1, 3), default=1, help="single or three phase inverter (default: 1)")
+    parser.add_argument("--no-math", action="store_true", help="disable the Auto Avg/Max math")
+    args = parser.parse_args()
+
+    values = dict(benchmark.INVERTER_VALUES, c_sunspec_did=101 if args.phases == 1 else 103)
+
+    plugin.Devices = Domoticz.Devices
+    plugin.Parameters = {
+        "Address": "127.0.0.1",
+        "Port": "502",
+        "Mode1": "Yes",
+        "Mode2": "1",
+        "Mode3": "1",
+        "Mode4": "math_disabled" if args.no_math else "math_enabled",
+        "Mode5": "Normal",
+        "Mode6": "state=no"
+    }
+
+    # Only setup the devices and processors; nothing is read.
+
+    _plugin = plugin._plugin
+    _plugin.add_devices = True
+
+    table = _plugin.findTable("Inverter", values["c_sunspec_did"])
+    _plugin.setupDevices("Inverter", table)
+
+    processors = _plugin.processors["Inverter"]
+    snapshot = {"Inverter": values}
+    _plugin.addDerivedValues(snapshot)
+    values = snapshot["Inverter"]
+
+    templates = {unit[Column.ID]: type(unit[Column.MATH])() for unit in table if isinstance(unit[Column.MATH], plugin.Window)}
+    staged = {}
+
+    before = measure(lambda heartbeat: interpret(table, values, heartbeat, templates), args.heartbeats)
+    after = measure(lambda heartbeat: process(processors, values, heartbeat, staged), args.heartbeats)
+
+    print("{} heartbeats; {} phase(s), {} units, math {}".format(
+        args.heartbeats, args.phases, len(table), "disabled" if args.no_math else "enabled"))
+    report("interpreted", before)
+    report("compiled", after)
+    print("{:>12}: {:.1f}x on average".format("speedup", sum(before) / sum(after)))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
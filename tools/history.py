@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# SolarEdge ModbusTCP - history export
+#
+# Source:  https://github.com/addiejanssen/domoticz-solaredge-modbustcp-plugin
+# Author:  Addie Janssen (https://addiejanssen.com)
+# License: MIT
+#
+
+"""
+Exports the values kept with the "history" option as CSV.
+
+    python3 tools/history.py solaredge.hist --start -3600 --step 10 --output last-hour.csv
+
+The file can be read while the plugin is writing to it.
+"""
+
+import argparse
+import sys
+import time
+
+from datetime import datetime
+
+import benchmark
+import plugin
+
+# A time is either a number of seconds relative to now, like -3600, or a date and time like 2021-06-01T12:00.
+
+def timestamp(value):
+    try:
+        return time.time() + float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the history of the plugin as CSV.")
+    parser.add_argument("history", help="the history file")
+    parser.add_argument("--start", type=timestamp, help="the first second to export (default: the oldest second in the history)")
+    parser.add_argument("--end", type=timestamp, default=time.time(), help="the last second to export (default: now)")
+    parser.add_argument("--step", type=int, default=1, help="average the values over steps of this many seconds (default: 1)")
+    parser.add_argument("--output", help="the CSV file to write (default: standard output)")
+    args = parser.parse_args()
+
+    history = plugin.History(args.history)
+    start = args.start if args.start is not None else args.end - history.seconds
+
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            history.export_csv(output, start, args.end, args.step)
+    else:
+        history.export_csv(sys.stdout, start, args.end, args.step)
+
+    history.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
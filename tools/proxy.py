@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# SolarEdge ModbusTCP - proxy check
+#
+# Source:  https://github.com/addiejanssen/domoticz-solaredge-modbustcp-plugin
+# Author:  Addie Janssen (https://addiejanssen.com)
+# License: MIT
+#
+
+"""
+Checks the Modbus TCP proxy of the plugin with a regular Modbus client.
+
+    python3 tools/proxy.py
+
+The plugin reads a simulated inverter from the pymodbus server of the benchmark and serves
+the registers on the proxy port. A pymodbus client then reads them from the proxy.
+"""
+
+import argparse
+import sys
+import time
+
+import benchmark
+import plugin
+
+from pymodbus.client.sync import ModbusTcpClient
+
+Domoticz = benchmark.Domoticz
+
+# The registers of the inverter model that the plugin reads; the common model and the inverter model.
+
+REGISTERS = [(40004, 65), (40069, 40)]
+
+# An address the plugin never reads, so it is not in the cache.
+
+UNCACHED = 40500
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the Modbus TCP proxy of the plugin.")
+    parser.add_argument("--phases", type=int, choices=(1, 3), default=1, help="single or three phase inverter (default: 1)")
+    parser.add_argument("--max-age", type=int, default=2, help="the highest age in seconds a cached register may have (default: 2)")
+    parser.add_argument("--verbose", action="store_true", help="print the log of the plugin")
+    args = parser.parse_args()
+
+    Domoticz.verbose = args.verbose
+
+    server = benchmark.SimulatedServer([1])
+    server.start()
+    inverter = benchmark.SimulatedInverter(server.units[1], 1, args.phases, 1)
+
+    plugin.Devices = Domoticz.Devices
+    plugin.Parameters = {
+        "Address": "127.0.0.1",
+        "Port": str(server.server_address[1]),
+        "Mode1": "Yes",
+        "Mode2": "1",
+        "Mode3": "1",
+        "Mode4": "math_enabled",
+        "Mode5": "Normal",
+        "Mode6": "state=no;proxy_port=0"
+    }
+
+    plugin.onStart()
+
+    # Wait till the reader has filled the cache.
+
+    reader = plugin._plugin.readers[0]
+    deadline = time.monotonic() + 10
+    while reader.timestamp is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    failures = []
+
+    def check(condition, message):
+        print("{}: {}".format("ok" if condition else "FAILED", message))
+        if not condition:
+            failures.append(message)
+
+    check(reader.timestamp is not None, "the plugin read the inverter")
+
+    client = ModbusTcpClient("127.0.0.1", port=plugin._plugin.proxy.server_address[1], timeout=5)
+
+    # The proxy returns the same registers as the inverter itself.
+
+    for (start, length) in REGISTERS:
+        result = client.read_holding_registers(start, length, unit=1)
+        expected = inverter.context.getValues(3, start, length)
+        check(not result.isError() and result.registers == expected, "registers {}-{} of unit 1 match the inverter".format(start, start + length - 1))
+
+    # Unit 250 returns the age in seconds of the same registers.
+
+    for (start, length) in REGISTERS:
+        result = client.read_holding_registers(start, length, unit=plugin.PROXY_AGE_UNIT)
+        check(not result.isError() and max(result.registers) <= args.max_age, "registers {}-{} of unit {} are at most {} seconds old".format(
+            start, start + length - 1, plugin.PROXY_AGE_UNIT, args.max_age))
+
+    # Registers that are not in the cache, and other units, are an "illegal data address" exception.
+
+    result = client.read_holding_registers(UNCACHED, 2, unit=1)
+    check(result.isError() and getattr(result, "exception_code", None) == 0x02, "uncached register {} returns exception 0x02".format(UNCACHED))
+
+    result = client.read_holding_registers(40000, 2, unit=2)
+    check(result.isError() and getattr(result, "exception_code", None) == 0x02, "unknown unit 2 returns exception 0x02")
+
+    # Only "read holding registers" is supported.
+
+    result = client.read_input_registers(40000, 2, unit=1)
+    check(result.isError() and getattr(result, "exception_code", None) == 0x01, "read input registers returns exception 0x01")
+
+    client.close()
+    plugin.onStop()
+    server.stop()
+
+    if failures:
+        print("{} check(s) failed".format(len(failures)))
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# SolarEdge ModbusTCP - offline replay
+#
+# Source:  https://github.com/addiejanssen/domoticz-solaredge-modbustcp-plugin
+# Author:  Addie Janssen (https://addiejanssen.com)
+# License: MIT
+#
+
+"""
+Replays a capture made with the "capture" option through the plugin, as fast as possible.
+
+    python3 tools/replay.py solaredge.cap --units 1,2 --log-level Debug --verbose
+
+Use the same Modbus device addresses as the plugin that made the capture.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from benchmark import Domoticz, Device, percentile
+
+import plugin
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a capture through the plugin.")
+    parser.add_argument("capture", help="the capture file")
+    parser.add_argument("--units", default="1", help="the Modbus device addresses of the inverters (default: 1)")
+    parser.add_argument("--no-math", action="store_true", help="disable the Auto Avg/Max math")
+    parser.add_argument("--options", default="", help="more options for the Options field of the plugin")
+    parser.add_argument("--log-level", choices=("Normal", "Extra", "Debug"), default="Normal", help="the log level of the plugin (default: Normal)")
+    parser.add_argument("--verbose", action="store_true", help="print the log of the plugin")
+    args = parser.parse_args()
+
+    Domoticz.verbose = args.verbose
+
+    plugin.Devices = Domoticz.Devices
+    plugin.Parameters = {
+        "HomeFolder": os.getcwd() + os.sep,
+        "Address": "127.0.0.1",
+        "Port": "502",
+        "Mode1": "Yes",
+        "Mode2": "1",
+        "Mode3": args.units,
+        "Mode4": "math_disabled" if args.no_math else "math_enabled",
+        "Mode5": args.log_level,
+        "Mode6": "state=no;replay={};{}".format(args.capture, args.options)
+    }
+
+    plugin.onStart()
+
+    if not plugin._plugin.readers:
+        return 1
+
+    reader = plugin._plugin.readers[0]
+    latencies = []
+    misses = 0
+    started = time.perf_counter()
+
+    while True:
+        before = time.perf_counter()
+        plugin.onHeartbeat()
+        latency = time.perf_counter() - before
+
+        if reader.finished:
+            break
+
+        latencies.append(latency)
+        misses += any(device.sValue.startswith("Key not found") for device in Domoticz.Devices.values())
+
+    elapsed = time.perf_counter() - started
+    plugin.onStop()
+
+    if not latencies:
+        print("The capture is empty")
+        return 1
+
+    latencies.sort()
+
+    print("{} reads replayed in {:.2f} seconds, {:.0f} per second".format(len(latencies), elapsed, len(latencies) / elapsed))
+    print("heartbeat latency: mean {:.0f} us, p50 {:.0f} us, p90 {:.0f} us, p99 {:.0f} us, max {:.0f} us".format(
+        sum(latencies) / len(latencies) * 1e6,
+        percentile(latencies, 0.50) * 1e6,
+        percentile(latencies, 0.90) * 1e6,
+        percentile(latencies, 0.99) * 1e6,
+        latencies[-1] * 1e6
+    ))
+    print("devices: {}, Device.Update calls: {}, heartbeats with lookup misses: {}".format(len(Domoticz.Devices), Device.updates, misses))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
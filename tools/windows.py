@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# SolarEdge ModbusTCP - sliding window microbenchmark
+#
+# Source:  https://github.com/addiejanssen/domoticz-solaredge-modbustcp-plugin
+# Author:  Addie Janssen (https://addiejanssen.com)
+# License: MIT
+#
+
+"""
+Compares the sliding windows of the plugin with the list based Average and Maximum classes they replaced.
+
+    python3 tools/windows.py --samples 30 300 3000
+
+Each round adds one sample and gets the value, like the plugin does for every unit on every heartbeat.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import benchmark
+import plugin
+
+Domoticz = benchmark.Domoticz
+
+#
+# The Average and Maximum classes as they used to be; only kept here to compare with.
+# The number of samples in the window was derived from the heartbeat interval.
+#
+
+class ListAverage:
+
+    def __init__(self):
+        self.samples = []
+        self.max_samples = 30
+
+    def set_max_samples(self, max):
+        self.max_samples = max
+        if self.max_samples < 1:
+            self.max_samples = 1
+
+    def update(self, new_value, scale = 0):
+        self.samples.append(new_value * (10 ** scale))
+        while (len(self.samples) > self.max_samples):
+            del self.samples[0]
+
+        Domoticz.Debug("Average: {} - {} values".format(self.get(), len(self.samples)))
+
+    def get(self):
+        return sum(self.samples) / len(self.samples)
+
+class ListMaximum:
+
+    def __init__(self):
+        self.samples = []
+        self.max_samples = 30
+
+    def set_max_samples(self, max):
+        self.max_samples = max
+        if self.max_samples < 1:
+            self.max_samples = 1
+
+    def update(self, new_value, scale = 0):
+        self.samples.append(new_value * (10 ** scale))
+        while (len(self.samples) > self.max_samples):
+            del self.samples[0]
+
+        Domoticz.Debug("Maximum: {} - {} values".format(self.get(), len(self.samples)))
+
+    def get(self):
+        return max(self.samples)
+
+# The time per round, in microseconds, after filling the window first.
+
+def measure_list(window, samples, values):
+    window.set_max_samples(samples)
+    for value in values[:samples]:
+        window.update(value)
+
+    started = time.perf_counter()
+    for value in values[samples:]:
+        window.update(value)
+        window.get()
+
+    return (time.perf_counter() - started) / (len(values) - samples) * 1e6
+
+def measure_window(window, samples, values):
+
+    # One sample per second, so the period covers the same samples as the list.
+
+    window.set_period(samples - 1)
+    for (timestamp, value) in enumerate(values[:samples]):
+        window.add(value, timestamp)
+
+    started = time.perf_counter()
+    for (timestamp, value) in enumerate(values[samples:], samples):
+        window.add(value, timestamp)
+        window.get()
+
+    return (time.perf_counter() - started) / (len(values) - samples) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the sliding windows with the list based classes.")
+    parser.add_argument("--samples", type=int, nargs="+", default=[30, 300, 3000], help="the number of samples in the window (default: 30 300 3000)")
+    parser.add_argument("--rounds", type=int, default=20000, help="the number of rounds to measure (default: 20000)")
+    parser.add_argument("--seed", type=int, default=1, help="the seed of the random values (default: 1)")
+    args = parser.parse_args()
+
+    print("{:>8}  {:>14}  {:>14}  {:>14}  {:>14}".format("samples", "list average", "Average", "list maximum", "Maximum"))
+
+    for samples in args.samples:
+        random.seed(args.seed)
+        values = [random.uniform(0, 5000) for i in range(samples + args.rounds)]
+
+        results = [
+            measure_list(ListAverage(), samples, values),
+            measure_window(plugin.Average(), samples, values),
+            measure_list(ListMaximum(), samples, values),
+            measure_window(plugin.Maximum(), samples, values)
+        ]
+
+        print("{:>8}  {:>11.2f} us  {:>11.2f} us  {:>11.2f} us  {:>11.2f} us".format(samples, *results))
+
+        # Both kinds of window hold the same samples, so they must agree on the highest one.
+
+        reference = ListMaximum()
+        window = plugin.Maximum()
+        reference.set_max_samples(samples)
+        window.set_period(samples - 1)
+        for (timestamp, value) in enumerate(values[:samples * 3]):
+            reference.update(value)
+            window.add(value, timestamp)
+            if reference.get() != window.get():
+                print("Maximum differs after {} samples: {} instead of {}".format(timestamp + 1, window.get(), reference.get()))
+                return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())